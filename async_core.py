@@ -0,0 +1,672 @@
+#!/usr/bin/python3
+"""
+Basil: Build A System Instant-Like
+Copyright (C) 2014 Catalyst IT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+asyncio versions of the core functions which wait on vagrant, providers or
+ports. Subprocess output and sockets are waited on by one event loop instead
+of a thread each.
+
+The blocking functions in core are thin wrappers which run these on a shared
+background loop (see run) so there is only one implementation. Coroutines can
+also be awaited directly from any other event loop.
+"""
+
+import asyncio
+from collections import deque
+from concurrent import futures
+from os.path import join
+import os
+import re
+import subprocess
+import sys
+from threading import Lock, Thread, current_thread
+import time
+import weakref
+import core
+import keys
+import settings
+
+_loop = None
+_loop_thread = None
+_loop_lock = Lock()
+# per event loop so coroutines can be awaited from any loop
+_semaphores = weakref.WeakKeyDictionary()
+_probes = weakref.WeakKeyDictionary() # {project_name: Future} in progress
+# commands' output is handled (and logged) here rather than in the loop's
+# default executor so slow status hooks etc. can't hold it up - a command
+# stalls once its pipe is full
+_output_executor = futures.ThreadPoolExecutor(max_workers=4)
+
+if sys.version_info < (3, 8):
+
+    class ThreadedChildWatcher(asyncio.AbstractChildWatcher):
+        """
+        Python 3.8's child watcher - a thread per child process waits for it
+        to exit. The default watcher before 3.8 only works for a loop in the
+        main thread.
+        """
+
+        def add_child_handler(self, pid, callback, *args):
+            Thread(target=self._wait, args=(pid, callback, args),
+                daemon=True).start()
+
+        def _wait(self, pid, callback, args):
+            try:
+                unused, status = os.waitpid(pid, 0)
+            except ChildProcessError:
+                returncode = 255 # reaped by someone else
+            else:
+                if os.WIFSIGNALED(status):
+                    returncode = -os.WTERMSIG(status)
+                elif os.WIFEXITED(status):
+                    returncode = os.WEXITSTATUS(status)
+                else:
+                    returncode = status
+            callback(pid, returncode, *args) # thread-safe for loop callbacks
+
+        def remove_child_handler(self, pid):
+            return True
+
+        def attach_loop(self, loop):
+            pass
+
+        def close(self):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+def get_loop():
+    """
+    The background event loop the blocking core functions use - started on
+    first use in a daemon thread.
+    """
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            if core.my_platform == core.WINDOWS:
+                loop = asyncio.ProactorEventLoop() # needed for subprocesses
+            else:
+                if sys.version_info < (3, 8):
+                    asyncio.set_child_watcher(ThreadedChildWatcher())
+                loop = asyncio.new_event_loop()
+            _loop_thread = Thread(target=run_loop, args=(loop, ),
+                daemon=True)
+            _loop_thread.start()
+            _loop = loop
+        return _loop
+
+def run_loop(loop):
+    """
+    Before Python 3.5.3 asyncio.get_event_loop() (which coroutines here and
+    asyncio itself use to find their loop) only knows about a loop set for
+    the thread - not the one running.
+    """
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def run(coro):
+    """
+    Run coro on the background loop and wait for its result.
+    """
+    loop = get_loop()
+    if current_thread() is _loop_thread:
+        raise Exception("Unable to wait for a coroutine from inside the "
+            "event loop running it - await it instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+def submit(coro):
+    """
+    Run coro on the background loop without waiting. Returns a
+    concurrent.futures.Future.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def get_semaphore(name, value):
+    """
+    The named semaphore for the running loop - made the first time asked.
+    """
+    semaphores = _semaphores.setdefault(asyncio.get_event_loop(), {})
+    if name not in semaphores:
+        semaphores[name] = asyncio.Semaphore(max(1, value))
+    return semaphores[name]
+
+def kill_process(p):
+    try:
+        p.kill()
+    except ProcessLookupError:
+        pass # already finished
+
+async def run_cmd_output(command_list, cwd=None, timeout=None):
+    """
+    Returns (stdout, stderr) as bytes. Raises asyncio.TimeoutError if the
+    command takes more than timeout seconds and
+    subprocess.CalledProcessError if it fails.
+    """
+    p = await asyncio.create_subprocess_exec(*command_list, cwd=cwd,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        output, err = await asyncio.wait_for(p.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        kill_process(p)
+        raise
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, command_list,
+            output, err)
+    return output, err
+
+async def read_output(reader, stream, handle_output_line):
+    """
+    Pass each OutputLine from reader (an asyncio.StreamReader) to
+    handle_output_line until EOF. That is done in _output_executor as it
+    writes the command's log.
+    """
+    def handle_output_lines(output_lines):
+        for output_line in output_lines:
+            handle_output_line(output_line)
+
+    loop = asyncio.get_event_loop()
+    pending = b""
+    while True:
+        chunk = await reader.read(core.output_chunk_size)
+        if not chunk:
+            break
+        output_lines, pending = core.split_output_lines(stream, pending, chunk)
+        if output_lines:
+            await loop.run_in_executor(_output_executor, handle_output_lines,
+                output_lines)
+    if pending:
+        await loop.run_in_executor(_output_executor, handle_output_line,
+            core.OutputLine(time.time(), stream,
+            str(pending, "utf-8", "replace")))
+
+async def execute_vagrant_cmd(command_list, project_directory,
+        command_progress, msg_transformer=None, callback=None):
+    """
+    See core.execute_blocking_vagrant_cmd. stdout and stderr are read as they
+    are written so neither pipe can fill up and stall the command.
+
+    callback is run in the loop's executor so it can take its time (e.g.
+    removing a project folder).
+    """
+    cmd = " ".join(command_list)
+    try:
+        p = await asyncio.create_subprocess_exec(*command_list,
+            cwd=project_directory, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+    except FileNotFoundError as e:
+        core.vagrant_cmd_not_found(cmd, e, command_progress)
+    command_progress.process = p
+    if command_progress.cancel_requested: # asked before we had a process
+        core.interrupt_process(p)
+    error_lines = deque(maxlen=core.max_error_lines)
+    def handle_output_line(output_line):
+        core.handle_vagrant_output_line(command_progress, output_line,
+            msg_transformer, error_lines)
+    try:
+        await asyncio.gather(
+            read_output(p.stdout, core.STDOUT, handle_output_line),
+            read_output(p.stderr, core.STDERR, handle_output_line))
+        returncode = await p.wait()
+    except asyncio.CancelledError:
+        kill_process(p)
+        raise
+    if callback:
+        await asyncio.get_event_loop().run_in_executor(None,
+            core.finish_vagrant_cmd, cmd, returncode, error_lines,
+            command_progress, callback)
+    else:
+        core.finish_vagrant_cmd(cmd, returncode, error_lines,
+            command_progress)
+
+
+class CommandWaiter(object):
+    """
+    CommandProgress observer which completes future (on loop) once the command
+    is done. Commands report progress from other threads.
+    """
+
+    def __init__(self, loop, future):
+        self.loop = loop
+        self.future = future
+
+    def update(self, command_progress, event):
+        if core.is_final_progress_event(event):
+            self.loop.call_soon_threadsafe(self.set_done)
+
+    def set_done(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+async def wait_for_command(command_progress):
+    """
+    Wait until the command is done and return its CommandProgress (check its
+    state for how it went). Cancelling the wait cancels the command.
+    """
+    loop = asyncio.get_event_loop()
+    waiter = CommandWaiter(loop, loop.create_future())
+    command_progress.addObserver(waiter)
+    try:
+        if command_progress.is_done: # finished before we were watching
+            waiter.set_done()
+        await waiter.future
+    except asyncio.CancelledError:
+        core.cancel_command(command_progress.command_id)
+        raise
+    finally:
+        command_progress.removeObserver(waiter)
+    return command_progress
+
+# Commands go through core.job_scheduler (priorities and concurrency limits
+# are shared with the blocking API) and are awaited until done.
+
+async def start_project(project_directory):
+    return await wait_for_command(core.start_project(project_directory))
+
+async def stop_project(project_directory):
+    return await wait_for_command(core.stop_project(project_directory))
+
+async def reset_project(project_directory):
+    return await wait_for_command(core.reset_project(project_directory))
+
+async def destroy_project(project_directory):
+    return await wait_for_command(core.destroy_project(project_directory))
+
+async def missing_virtualbox(project_directory):
+    """
+    --machine-readable at end of vagrant status prevents message being output
+    when VB not detected
+    """
+    try:
+        await run_cmd_output(["vagrant", "status"], project_directory,
+            settings.status_timeout)
+        missing = False
+    except asyncio.CancelledError:
+        raise
+    except subprocess.CalledProcessError as e:
+        missing = b"could not detect VirtualBox!" in e.stderr
+    except Exception:
+        missing = False
+    return missing
+
+async def get_project_status_via_vagrant(project_name, template_name,
+        template_version):
+    """
+    Fail hard if prerequisites for _any_ status checks are missing.
+
+    Return response in usual format if potentially a failure isolated to
+    a particular project. Use VAGRANT_STATUS_STATE_UNKNOWN.
+    """
+    project_directory = join(core.projects_dir, project_name)
+    try:
+        output, unused = await run_cmd_output(["vagrant", "status",
+            "--machine-readable"], project_directory, settings.status_timeout)
+    except FileNotFoundError:
+        raise Exception("Unable to get project status using vagrant. Is "
+            "vagrant installed on this machine?")
+    except asyncio.TimeoutError:
+        return core.get_unknown_status(project_name, template_name,
+            template_version, "Timed out after {} seconds waiting for "
+            "project status.".format(settings.status_timeout))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        if await missing_virtualbox(project_directory):
+            raise Exception("VirtualBox needs to be installed before you "
+                "can use Basil")
+        else:
+            return core.get_unknown_status(project_name, template_name,
+                template_version, "Problem getting project status. {}"
+                .format(e))
+    return core.read_vagrant_status(project_name, template_name,
+        template_version, str(output, "utf-8"))
+
+async def run_provider_list_cmd(command_list, pattern):
+    """
+    Run a provider command listing machines and return the set of ids
+    matching the first group of pattern on each line. None if the command
+    isn't available or fails.
+    """
+    try:
+        output, unused = await run_cmd_output(command_list,
+            timeout=settings.status_timeout)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        return None
+    machine_ids = set()
+    for line in str(output, "utf-8").split("\n"):
+        match = re.search(pattern, line)
+        if match:
+            machine_ids.add(match.group(1).lower())
+    return machine_ids
+
+async def get_virtualbox_machine_states():
+    """
+    Lines look like: "basil_default_1412312312_1234" {0b3c3f1e-...}
+    """
+    uuid_pattern = r"\{([0-9a-fA-F-]+)\}\s*$"
+    running, known = await asyncio.gather(
+        run_provider_list_cmd([settings.vboxmanage_cmd, "list",
+            "runningvms"], uuid_pattern),
+        run_provider_list_cmd([settings.vboxmanage_cmd, "list", "vms"],
+            uuid_pattern))
+    if running is None or known is None:
+        return None
+    return core.MachineStates(running, known)
+
+async def get_libvirt_machine_states():
+    """
+    vagrant-libvirt uses the domain UUID as the machine id.
+    """
+    uuid_pattern = r"^\s*([0-9a-fA-F-]{36})\s*$"
+    virsh = [settings.virsh_cmd, "--connect", settings.libvirt_uri, "list",
+        "--uuid"]
+    running, known = await asyncio.gather(
+        run_provider_list_cmd(virsh, uuid_pattern),
+        run_provider_list_cmd(virsh + ["--all"], uuid_pattern))
+    if running is None or known is None:
+        return None
+    return core.MachineStates(running, known)
+
+provider_state_queries = {
+    "virtualbox": get_virtualbox_machine_states,
+    "libvirt": get_libvirt_machine_states,
+}
+
+
+class MachineStatesSnapshot(object):
+    """
+    The provider machine states for one batch of status probes. Each provider
+    is queried once, in bulk, the first time a project using it asks. Only
+    use it from one event loop.
+    """
+
+    def __init__(self):
+        self._queries = {}
+
+    async def get(self, provider):
+        """
+        Returns MachineStates for the provider or None if it can't be asked.
+        """
+        if provider not in self._queries:
+            query = provider_state_queries.get(provider)
+            if not query:
+                return None
+            self._queries[provider] = asyncio.ensure_future(query())
+        # one probe timing out mustn't cancel the query for everyone else
+        return await asyncio.shield(self._queries[provider])
+
+async def get_project_status_via_provider(project_name, template_name,
+        template_version, machine_states_snapshot):
+    """
+    Fast path - read vagrant's machine ids and look them up in the provider's
+    bulk listing instead of running vagrant status.
+
+    Only single machine projects which are running, or whose machine is gone
+    (not created), are decided here. Anything else (e.g. poweroff vs aborted
+    vs saved) needs vagrant so returns None.
+    """
+    machine_ids = core.read_machine_ids(project_name)
+    if len(machine_ids) != 1:
+        return None
+    (unused, provider), machine_id = machine_ids.popitem()
+    if machine_id is None:
+        state = "not_created"
+    else:
+        machine_states = await machine_states_snapshot.get(provider)
+        if machine_states is None:
+            return None
+        if machine_id.lower() in machine_states.running:
+            state = "running"
+        elif machine_id.lower() not in machine_states.known:
+            state = "not_created"
+        else:
+            return None
+    return core.make_project_status(project_name, template_name,
+        template_version, state, state.replace("_", " "),
+        core.provider_state_msgs[state])
+
+async def get_project_status(project_name, template_name, template_version,
+        machine_states_snapshot=None):
+    """
+    Uses lib.py version if available (loaded and run in the loop's executor
+    as they block), otherwise the fast provider approach (if settings.status_backend
+    allows), falling back to the default approach using vagrant.
+
+    machine_states_snapshot -- share one between the projects in a batch so
+    each provider is only asked once.
+    """
+    loop = asyncio.get_event_loop()
+    template_lib = await loop.run_in_executor(None, core.template_load_lib,
+        template_name)
+    project_status_func = None
+    if template_lib:
+        project_status_func = (template_lib.__dict__
+            .get(keys.PROJECT_STATUS_FUNCNAME))
+    if project_status_func:
+        return await loop.run_in_executor(None, project_status_func,
+            project_name, template_name, template_version)
+    if settings.status_backend == keys.STATUS_BACKEND_AUTO:
+        if machine_states_snapshot is None:
+            machine_states_snapshot = MachineStatesSnapshot()
+        project_status = await get_project_status_via_provider(project_name,
+            template_name, template_version, machine_states_snapshot)
+        if project_status:
+            return project_status
+    return await get_project_status_via_vagrant(project_name, template_name,
+        template_version)
+
+async def probe_project_statuses(project_infos):
+    """
+    Get fresh statuses for the given ProjectInfos (in the same order).
+
+    No more than settings.status_workers projects are probed at once so one
+    slow project doesn't hold up the rest. A probe gets
+    settings.status_timeout seconds from when it starts - after that the
+    project is reported as VAGRANT_STATUS_STATE_UNKNOWN. Problems which affect
+    every project (e.g. vagrant missing) still fail hard.
+    """
+    semaphore = get_semaphore("status", settings.status_workers)
+    machine_states_snapshot = MachineStatesSnapshot()
+    async def probe(project_info):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(get_project_status(
+                    project_info.project_name, project_info.template_name,
+                    project_info.template_version, machine_states_snapshot),
+                    settings.status_timeout)
+            except asyncio.TimeoutError:
+                return core.get_unknown_status(project_info.project_name,
+                    project_info.template_name,
+                    project_info.template_version, "Timed out after {} "
+                    "seconds waiting for project status."
+                    .format(settings.status_timeout))
+    probes = [asyncio.ensure_future(probe(project_info))
+        for project_info in project_infos]
+    try:
+        return list(await asyncio.gather(*probes))
+    finally:
+        for unfinished in probes: # if one failed hard
+            unfinished.cancel()
+
+async def probe_and_cache(project_infos):
+    """
+    Fresh statuses for the given ProjectInfos (in the same order), stored in
+    core.status_cache. A project already being probed on this loop isn't
+    probed again - its result is shared, unless the project has been
+    invalidated (e.g. by a command finishing) since that probe started.
+    Statuses are only stored if the project wasn't invalidated while being
+    probed.
+    """
+    loop = asyncio.get_event_loop()
+    probes = _probes.setdefault(loop, {})
+    to_probe = {}
+    futures = []
+    for project_info in project_infos:
+        project_name = project_info.project_name
+        invalidation_marker = core.status_cache.invalidation_marker(
+            project_name)
+        probe = probes.get(project_name)
+        if probe is None or probe[0] != invalidation_marker:
+            probe = (invalidation_marker, loop.create_future())
+            probes[project_name] = probe
+            to_probe[project_name] = probe
+        futures.append(probe[1])
+    if to_probe:
+        asyncio.ensure_future(run_probes([project_info
+            for project_info in project_infos
+            if project_info.project_name in to_probe], to_probe, probes))
+    # one waiter giving up mustn't cancel the probe for everyone else
+    return list(await asyncio.gather(*[asyncio.shield(future)
+        for future in futures]))
+
+async def run_probes(project_infos, to_probe, probes):
+    """
+    Probe and cache. to_probe maps project names to (invalidation marker,
+    future) - each future is completed and removed from probes (unless
+    already replaced there by a newer probe).
+    """
+    invalidation_markers = {project_name: invalidation_marker
+        for project_name, (invalidation_marker, unused) in to_probe.items()}
+    try:
+        project_statuses = await probe_project_statuses(project_infos)
+        core.cache_project_statuses(project_statuses, invalidation_markers)
+    except Exception as e:
+        project_statuses = None
+        error = e
+    for project_name, probe in to_probe.items():
+        if probes.get(project_name) is probe:
+            del probes[project_name]
+    if project_statuses is None:
+        for unused, future in to_probe.values():
+            future.set_exception(error)
+            future.exception() # retrieved - nobody may be waiting
+        return
+    for project_status in project_statuses:
+        to_probe[project_status.project_name][1].set_result(project_status)
+
+async def refresh_project_statuses(project_infos):
+    """
+    See core.refresh_project_statuses.
+    """
+    try:
+        await probe_and_cache(project_infos)
+    except Exception:
+        pass # the next request will miss and report the problem
+
+async def get_project_statuses(use_cache=True):
+    """
+    Get project statuses - from core.status_cache where possible. Misses are
+    probed straight away; stale entries are returned as is and refreshed in
+    the background.
+    """
+    project_infos = await asyncio.get_event_loop().run_in_executor(None,
+        core.get_project_infos)
+    if not use_cache:
+        return await probe_and_cache(project_infos)
+    core.status_cache.retain(project_info.project_name
+        for project_info in project_infos)
+    statuses = {}
+    to_probe = []
+    to_refresh = []
+    for project_info in project_infos:
+        project_status, is_fresh = core.status_cache.get(
+            project_info.project_name)
+        if project_status is None:
+            to_probe.append(project_info)
+            continue
+        statuses[project_info.project_name] = project_status
+        if not is_fresh:
+            to_refresh.append(project_info)
+    if to_probe:
+        probed = await probe_and_cache(to_probe)
+        statuses.update((project_status.project_name, project_status)
+            for project_status in probed)
+    if to_refresh:
+        core.refresh_project_statuses(to_refresh)
+    return [statuses[project_info.project_name]
+        for project_info in project_infos]
+
+async def probe_port(port, mode=None, timeout=None):
+    """
+    Returns True if something on localhost answers on the port.
+
+    mode -- keys.PORT_CHECK_HTTP (any reply to a HEAD request will do) or
+    keys.PORT_CHECK_TCP (a connection is enough). Defaults to
+    settings.port_check_mode.
+    timeout -- seconds (for connecting and again for a reply). Defaults to
+    settings.port_check_timeout.
+    """
+    mode = settings.port_check_mode if mode is None else mode
+    timeout = settings.port_check_timeout if timeout is None else timeout
+    if mode not in (keys.PORT_CHECK_HTTP, keys.PORT_CHECK_TCP):
+        raise Exception("Unknown port check mode \"{}\"".format(mode))
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            'localhost', port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        if mode == keys.PORT_CHECK_TCP:
+            return True
+        writer.write(b"HEAD / HTTP/1.1\r\nHost: localhost\r\n"
+            b"Connection: close\r\n\r\n")
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        return status_line.startswith(b"HTTP/")
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+async def check_projects_ports(project_names, mode=None, timeout=None):
+    """
+    Returns a dict mapping each project name to a list of its ports that are
+    unreachable. Projects whose details can't be read are left out.
+
+    Every port of every project is probed at once (no more than
+    settings.port_check_workers at a time), so a batch takes about as long as
+    its slowest probe, which is bounded by the timeout. See probe_port.
+    """
+    project_ports = await asyncio.get_event_loop().run_in_executor(None,
+        core.get_project_ports, project_names)
+    failed = {project_name: [] for project_name, unused, unused
+        in project_ports}
+    semaphore = get_semaphore("ports", settings.port_check_workers)
+    async def probe(port):
+        async with semaphore:
+            return await probe_port(port, mode, timeout)
+    reachable = await asyncio.gather(*[probe(port)
+        for unused, unused, port in project_ports])
+    for (project_name, name, unused), is_reachable in zip(project_ports,
+            reachable):
+        if not is_reachable:
+            failed[project_name].append(name)
+    return failed
+
+async def check_project_ports(project_name, mode=None, timeout=None):
+    """
+    Returns a list of project ports that are unreachable.
+    """
+    # fail if no such project
+    await asyncio.get_event_loop().run_in_executor(None, core.get_project_info,
+        project_name)
+    return (await check_projects_ports([project_name], mode, timeout)).get(
+        project_name, [])
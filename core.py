@@ -34,23 +34,36 @@ Once a template has made a project, it has no further connection to that
 project.
 """
 
-from collections import namedtuple
+import argparse
+from collections import deque, namedtuple, OrderedDict
+from concurrent import futures
+from contextlib import contextmanager
 from enum import Enum
-import fileinput
 from functools import partial
+import hashlib
 import importlib.machinery
 import json
 import os
 from os.path import join
+import queue
 import re
 import shutil
-import http.client
+import itertools
+import signal
+import socket
+import stat
 import subprocess
 import sys
-from threading import Thread
+from threading import Condition, Event, Lock, RLock, Thread
+import time
 import tkinter
+import uuid
 from tkinter import filedialog
 import webbrowser
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # e.g. Windows - no reflinks
 
 import keys
 import settings
@@ -85,12 +98,39 @@ default_fields = {
 
 OpenCommand = namedtuple("OpenCommand", ("cmd_bits", "lbl"))
 
+# kind is one of the keys.PROGRESS_* keys e.g. keys.PROGRESS_DETAILS
+ProgressEvent = namedtuple("ProgressEvent", ("kind", "data"))
+done_progress_states = (keys.CommandProgressStates.FINISHED,
+    keys.CommandProgressStates.ERROR, keys.CommandProgressStates.CANCELLED)
+
+# sets of (lower case) provider machine ids
+MachineStates = namedtuple("MachineStates", ("running", "known"))
+# as vagrant itself reports them
+provider_state_msgs = {
+    "running": "The VM is running.",
+    "not_created": "The environment has not yet been created. Run `vagrant "
+        "up` to create the environment.",
+}
+
 basil_tag_start = "{{__basil__."
 basil_tag_end = "}}"
 basil_bash_start = "#basil_bash_start #####" # using # instead of, for eg, * otherwise regex treats as multiple repeats ;-)
 basil_bash_end = "#basil_bash_end #####"
-
-port_range_start = 45600
+# group 1 is the field name. Tags don't span lines.
+basil_tag_re = re.compile(re.escape(basil_tag_start.encode('utf-8'))
+    + b"(.+?)" + re.escape(basil_tag_end.encode('utf-8')))
+binary_sniff_size = 8192 # a NUL byte in this much of a file means binary
+manifest_version = 1
+FICLONE = 0x40049409 # Linux ioctl to reflink a file (see ioctl_ficlone(2))
+
+# vagrant command output
+STDOUT = "stdout"
+STDERR = "stderr"
+OutputLine = namedtuple("OutputLine", ("timestamp", "stream", "text"))
+output_chunk_size = 8192
+max_output_line_length = 16*1024 # longer lines are split
+max_error_lines = 200 # only the most recent stderr lines make the error message
+command_log_ext = ".log"
 
 min_vagrant = '1.4'
 
@@ -109,16 +149,16 @@ else:
     my_platform = UNKNOWN_PLATFORM
 
 def template_load_lib(template_name):
-    try:
-        loader = importlib.machinery.SourceFileLoader(template_name + '.lib',
-            os.path.join(templates_dir, template_name, 'lib.py'))
-        template_lib = loader.load_module()
-    except:
-        template_lib = None
-    return template_lib
+    """
+    The template's lib.py module, or None if it hasn't one (or it won't load).
+    """
+    return template_registry.get_lib(template_name)
 
 def template_load_config(template_name):
-    return load_config(join(templates_dir, template_name, keys.TEMPLATE_CONFIG))
+    """
+    The template's parsed config.json - shared so don't modify it.
+    """
+    return template_registry.get(template_name).config
 
 def project_load_config(project_name):
     return load_config(join(projects_dir, project_name,
@@ -155,14 +195,130 @@ def install_template(template_path):
     Copies the template from template_path into templates_directory.
     @LATER: Should also accept .tar.gz/.zip/.bz2/etc.
     """
-    template_name = os.path.split(template_path)[-1]
+    template_name = os.path.split(os.path.normpath(template_path))[-1]
     dest_path = join(templates_dir, template_name)
     try:
-        shutil.copy(template_path, dest_path)
+        shutil.copytree(template_path, dest_path)
+        save_manifest(template_name, build_manifest(template_name))
     except Exception as e:
         raise Exception("Unable to install template \"{}\". "
             "Original error: {}".format(template_name, e))
 
+# config -- parsed config.json; info -- TemplateInfo
+TemplateEntry = namedtuple("TemplateEntry", ("name", "signature", "config",
+    "info"))
+
+
+class TemplateRegistry(object):
+    """
+    In-memory configs and TemplateInfos for the templates in
+    templates_directory.
+
+    A template's config.json is only parsed again once its mtime (or size)
+    changes. version goes up whenever anything in the catalogue changes so
+    callers can tell if what they built from it is out of date. Use reload to
+    start again from disk.
+    """
+
+    def __init__(self, templates_directory):
+        self.templates_directory = templates_directory
+        self.version = 0
+        self._entries = {} # template_name: TemplateEntry
+        self._libs = {} # template_name: (lib.py signature, module or None)
+        self._lock = Lock()
+        self._lib_lock = Lock() # so a lib.py is only executed once per change
+
+    def get(self, template_name):
+        """
+        Returns the template's TemplateEntry.
+        """
+        config_path = join(self.templates_directory, template_name,
+            keys.TEMPLATE_CONFIG)
+        try:
+            config_stat = os.stat(config_path)
+        except OSError:
+            self._discard(template_name)
+            raise
+        signature = (config_stat.st_mtime_ns, config_stat.st_size)
+        with self._lock:
+            entry = self._entries.get(template_name)
+        if entry and entry.signature == signature:
+            return entry
+        config = load_config(config_path)
+        try:
+            template_info = TemplateInfo(
+                template_name,
+                config[keys.TEMPLATE_CONFIG_TITLE],
+                config[keys.TEMPLATE_CONFIG_DESCRIPTION],
+                config[keys.TEMPLATE_CONFIG_TEMPLATE_VERSION])
+        except KeyError:
+            template_info = None # only a problem when listing templates
+        entry = TemplateEntry(template_name, signature, config, template_info)
+        with self._lock:
+            self._entries[template_name] = entry
+            self.version += 1
+        return entry
+
+    def list(self):
+        """
+        Returns the TemplateEntries of every template, in name order.
+        """
+        template_names = sorted(x for x in os.listdir(self.templates_directory)
+            if os.path.isdir(join(self.templates_directory, x)))
+        with self._lock:
+            for template_name in set(self._entries) - set(template_names):
+                del self._entries[template_name]
+                self.version += 1
+        return [self.get(template_name) for template_name in template_names]
+
+    def get_lib(self, template_name):
+        """
+        Returns the template's lib.py module (None if it hasn't one or it won't
+        load). lib.py is only executed again when its mtime or size changes.
+        """
+        lib_path = join(self.templates_directory, template_name, 'lib.py')
+        try:
+            lib_stat = os.stat(lib_path)
+        except OSError:
+            return None
+        signature = (lib_stat.st_mtime_ns, lib_stat.st_size)
+        with self._lib_lock:
+            cached = self._libs.get(template_name)
+            if cached and cached[0] == signature:
+                return cached[1]
+            try:
+                loader = importlib.machinery.SourceFileLoader(
+                    template_name + '.lib', lib_path)
+                template_lib = loader.load_module()
+            except:
+                template_lib = None
+            self._libs[template_name] = (signature, template_lib)
+            return template_lib
+
+    def _discard(self, template_name):
+        with self._lock:
+            if self._entries.pop(template_name, None) is not None:
+                self.version += 1
+
+    def reload(self):
+        """
+        Forget everything so templates are read from disk again.
+        """
+        with self._lib_lock:
+            self._libs.clear()
+        with self._lock:
+            self._entries.clear()
+            self.version += 1
+        return self.version
+
+template_registry = TemplateRegistry(templates_dir)
+
+def reload_templates():
+    """
+    Returns the new version of the template catalogue.
+    """
+    return template_registry.reload()
+
 def get_templates():
     """
     Templates are folders. They must contain a config.json file and optionally
@@ -173,15 +329,13 @@ def get_templates():
         'A basic Django development installation.') ]
     """
     template_infos = []
-    template_names = [x for x in os.listdir(templates_dir)
-        if os.path.isdir(join(templates_dir, x))]
-    for template_name in template_names:
-        template_config = template_load_config(template_name)
-        template_infos.append(TemplateInfo(
-            template_name,
-            template_config[keys.TEMPLATE_CONFIG_TITLE],
-            template_config[keys.TEMPLATE_CONFIG_DESCRIPTION],
-            template_config[keys.TEMPLATE_CONFIG_TEMPLATE_VERSION]))
+    for entry in template_registry.list():
+        if entry.info is None:
+            raise Exception("The \"{}\" template's {} needs a {}, {} and {}"
+                .format(entry.name, keys.TEMPLATE_CONFIG, keys.TEMPLATE_CONFIG_TITLE,
+                keys.TEMPLATE_CONFIG_DESCRIPTION,
+                keys.TEMPLATE_CONFIG_TEMPLATE_VERSION))
+        template_infos.append(entry.info)
     template_infos.sort(key=lambda s: s.title)
     return template_infos
 
@@ -205,7 +359,161 @@ def get_default_field_validators(field_name):
     """
     return default_fields[field_name][keys.TEMPLATE_FIELD_VALIDATORS]
 
-def get_ports(template_name):
+class PortAllocator(object):
+    """
+    Hands out ports in [range_start, range_end) so no two projects share one.
+
+    The ports in use are kept in an index file in the projects directory
+    (project name: {port tag: port}) instead of reading every project's .basil
+    each time. Each allocation brings the index into line with the project
+    folders - folders which have gone are dropped and only new ones (e.g.
+    copied in by hand) have their .basil read. Allocated ports are reserved
+    for the project straight away, under a lock, so concurrent creates never
+    get the same port. With check_host, ports something else on the host is
+    already listening on are skipped too.
+    """
+
+    def __init__(self, projects_directory, range_start, range_end,
+            check_host=False):
+        self.projects_directory = projects_directory
+        self.index_path = join(projects_directory, keys.BASIL_PORT_INDEX)
+        self.range_start = range_start
+        self.range_end = range_end
+        self.check_host = check_host
+        self._projects = None # project_name: {port_tag: port}
+        self._used = set()
+        self._reserved = set() # being created so no folder yet
+        self._lock = Lock()
+
+    def _load(self):
+        if self._projects is not None:
+            return
+        try:
+            with open(self.index_path) as f:
+                self._projects = json.load(f)
+        except (OSError, ValueError):
+            self._projects = {} # rebuilt from the projects by _sync
+        self._reindex()
+
+    def _reindex(self):
+        self._used = set(itertools.chain.from_iterable(ports.values()
+            for ports in self._projects.values()))
+
+    def _save(self):
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._projects, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass # what is held in memory is still right and gets resynced
+
+    def _sync(self):
+        try:
+            project_names = {x for x in os.listdir(self.projects_directory)
+                if not x.startswith(".")
+                and os.path.isdir(join(self.projects_directory, x))}
+        except OSError:
+            project_names = set()
+        changed = False
+        for project_name in (set(self._projects) - project_names
+                - self._reserved):
+            del self._projects[project_name]
+            changed = True
+        for project_name in project_names - set(self._projects):
+            try:
+                ports = get_project_info(project_name).ports
+            except Exception:
+                continue # try again next time
+            self._projects[project_name] = ports
+            changed = True
+        if changed:
+            self._reindex()
+            self._save()
+
+    def _is_free_on_host(self, port):
+        sock = socket.socket()
+        try:
+            sock.bind(('', port))
+        except OSError:
+            return False
+        finally:
+            sock.close()
+        return True
+
+    def allocate(self, project_name, port_tags):
+        """
+        Returns a dict mapping each port tag to a free port, reserved for
+        project_name until released. Call confirm once the project folder
+        exists, or release if the project couldn't be made.
+        """
+        allocated, failed = self.allocate_many([project_name], port_tags)
+        if failed:
+            raise Exception(failed[project_name])
+        return allocated[project_name]
+
+    def allocate_many(self, project_names, port_tags):
+        """
+        As for allocate but for several projects (all wanting the same port
+        tags) in one pass over the port range and with one save of the index.
+
+        Returns (allocated, failed) - allocated maps project names to their
+        port dicts and failed maps project names to error messages.
+        """
+        allocated = OrderedDict()
+        failed = {}
+        with self._lock:
+            self._load()
+            self._sync()
+            current_port = self.range_start
+            for project_name in project_names:
+                if project_name in self._projects:
+                    failed[project_name] = ("The \"{}\" project already "
+                        "exists so either \"Destroy Project\" or choose "
+                        "another name".format(project_name))
+                    continue
+                assigned_ports = {}
+                for port_tag in port_tags:
+                    while current_port < self.range_end and (
+                            current_port in self._used or (self.check_host
+                            and not self._is_free_on_host(current_port))):
+                        current_port += 1
+                    if current_port >= self.range_end:
+                        break
+                    assigned_ports[port_tag] = current_port
+                    current_port += 1
+                if len(assigned_ports) < len(set(port_tags)):
+                    failed[project_name] = ("No free ports left between {} and "
+                        "{} for the \"{}\" project".format(self.range_start,
+                        self.range_end - 1, project_name))
+                    continue
+                self._projects[project_name] = assigned_ports
+                self._reserved.add(project_name)
+                self._used.update(assigned_ports.values())
+                allocated[project_name] = assigned_ports
+            if allocated:
+                self._save()
+        return allocated, failed
+
+    def confirm(self, project_name):
+        with self._lock:
+            self._reserved.discard(project_name)
+
+    def release(self, project_name):
+        """
+        Free a project's ports e.g. once it has been destroyed.
+        """
+        with self._lock:
+            self._load()
+            self._reserved.discard(project_name)
+            if self._projects.pop(project_name, None) is not None:
+                self._reindex()
+                self._save()
+
+port_allocator = PortAllocator(projects_dir, settings.port_range_start,
+    settings.port_range_end, settings.port_check_host_free)
+
+def get_ports(template_name, project_name):
     """
     We want to be able to assign ports to the projects to avoid potential
     collisions. Some templates will need to use the same port in multiple
@@ -224,22 +532,12 @@ def get_ports(template_name):
        other_config: ... 8080
 
     Returns a dictionary that maps each "port tag" in the template to an
-    available port that isn't in use by any other projects.
+    available port that isn't in use by any other projects. The ports are
+    reserved for project_name - see PortAllocator.allocate.
     """
-    assigned_ports = {}
     config = template_load_config(template_name)
-    if keys.TEMPLATE_CONFIG_PORTS in config:
-        port_tags = config[keys.TEMPLATE_CONFIG_PORTS]
-        used_ports = []
-        for project in get_project_infos():
-            used_ports += project.ports.values()
-        current_port = port_range_start
-        for port_tag in port_tags:
-            while current_port in used_ports:
-                current_port += 1
-            assigned_ports[port_tag] = current_port
-            current_port += 1
-    return assigned_ports
+    port_tags = config.get(keys.TEMPLATE_CONFIG_PORTS, [])
+    return port_allocator.allocate(project_name, port_tags)
 
 def validate_fields(template_name, values):
     """
@@ -288,53 +586,229 @@ def validate_fields(template_name, values):
                 validator_name))
     return errors
 
-def process_rewrite(path, values):
+def tag_replacements(values):
     """
-    Walk through every line in the given file, replacing basil tags with the
-    given values.
+    Turn field values into what render_stream needs - field name to replacement,
+    both encoded.
     values dict -- may have numbers (e.g. port) as vals
     """
-    # Iterate over every line in the file, using print() to rewrite each line.
-    # See: http://pymotw.com/2/fileinput/#in-place-filtering
-    with fileinput.input(files=(path), inplace=True) as f:
-        for line in f:
-            for field_name, value in values.items():
-                orig = basil_tag_start + field_name + basil_tag_end
-                line = line.replace(orig, str(value))
-            print(line, end="") # note -- print operates differently in context
+    return {str(field_name).encode('utf-8'): str(value).encode('utf-8')
+        for field_name, value in values.items()}
+
+def render_stream(src, dest, replacements):
+    """
+    Copy binary file src to dest line by line, replacing basil tags.
+    """
+    def replace(match):
+        return replacements.get(match.group(1), match.group(0))
+    for line in src:
+        dest.write(basil_tag_re.sub(replace, line))
 
-def process_rename(path, values):
+class PhaseTimer(object):
     """
-    Replace basil tags in the given path with the given values.
+    Adds up how long (seconds) each named phase of some work takes e.g.
+
+        with timer.phase("files"):
+            ...
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = (self.timings.get(name, 0)
+                + time.monotonic() - started)
+
+
+def run_in_pool(func, items):
+    """
+    Call func on every item in a pool of settings.render_workers threads (or
+    just in this one if there is no point). Raises the first exception.
+    """
+    n_workers = max(1, min(settings.render_workers, len(items)))
+    if n_workers == 1:
+        for item in items:
+            func(item)
+        return
+    with futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for unused in executor.map(func, items):
+            pass
+
+def manifest_signature(base_directory, manifest):
+    """
+    A hash of the mtime (and size) of every folder and file in the manifest -
+    cheap to check as it needs no reads. Editing a file changes its mtime and
+    adding, removing or renaming anything changes the mtime of its folder.
+    Returns None if anything in the manifest has gone.
+    """
+    signature = hashlib.sha1()
+    try:
+        for entry in manifest["dirs"]:
+            dir_stat = os.stat(join(base_directory, entry["path"]))
+            signature.update("{}\0{}\n".format(entry["path"],
+                dir_stat.st_mtime_ns).encode('utf-8', 'surrogateescape'))
+        for entry in manifest["files"]:
+            file_stat = os.stat(join(base_directory, entry["path"]))
+            signature.update("{}\0{}\0{}\n".format(entry["path"],
+                file_stat.st_mtime_ns, file_stat.st_size).encode('utf-8',
+                'surrogateescape'))
+    except OSError:
+        return None
+    return signature.hexdigest()
+
+def build_manifest(template_name):
+    """
+    Describe a template's project_base so projects can be made from it in one
+    pass - every folder and file (paths relative to project_base, "/"
+    separated, parents before children) with its mode and, for files, the
+    basil tags in it (None if binary). Also records a content hash of the
+    whole template and a signature for spotting changes (see
+    manifest_signature).
+    """
+    base_directory = join(templates_dir, template_name, keys.PROJECT_BASE)
+    manifest = {"manifest_version": manifest_version, "dirs": [], "files": []}
+    content_hash = hashlib.sha1()
+    for root, dirs, files in os.walk(base_directory, followlinks=True):
+        dirs.sort()
+        rel_root = os.path.relpath(root, base_directory)
+        rel_root = "" if rel_root == os.curdir else rel_root.replace(os.sep,
+            "/") + "/"
+        manifest["dirs"].append({"path": rel_root.rstrip("/"),
+            "mode": stat.S_IMODE(os.stat(root).st_mode)})
+        for name in sorted(files):
+            path = join(root, name)
+            with open(path, 'rb') as f:
+                content = f.read()
+            if b"\0" in content[:binary_sniff_size]:
+                tags = None
+            else:
+                tags = sorted(tag.decode('utf-8', 'surrogateescape')
+                    for tag in set(basil_tag_re.findall(content)))
+            rel_path = rel_root + name
+            content_hash.update(rel_path.encode('utf-8', 'surrogateescape')
+                + b"\0" + hashlib.sha1(content).digest())
+            manifest["files"].append({"path": rel_path,
+                "mode": stat.S_IMODE(os.stat(path).st_mode), "tags": tags})
+    manifest["content_hash"] = content_hash.hexdigest()
+    manifest["signature"] = manifest_signature(base_directory, manifest)
+    return manifest
+
+def save_manifest(template_name, manifest):
+    manifest_path = join(templates_dir, template_name, keys.TEMPLATE_MANIFEST)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def get_manifest(template_name):
+    """
+    The template's manifest - rebuilt (and saved if possible) if it is missing
+    or the template has changed since it was built.
+    """
+    manifest_path = join(templates_dir, template_name, keys.TEMPLATE_MANIFEST)
+    base_directory = join(templates_dir, template_name, keys.PROJECT_BASE)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if (manifest.get("manifest_version") == manifest_version
+                and manifest["signature"] == manifest_signature(base_directory,
+                    manifest)):
+            return manifest
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    manifest = build_manifest(template_name)
+    try:
+        save_manifest(template_name, manifest)
+    except OSError:
+        pass # e.g. read-only templates - still fine to use
+    return manifest
+
+def render_path(rel_path, values):
+    """
+    Replace basil tags in a manifest path.
     values dict -- may have numbers (e.g. port) as vals
     """
-    directory, name = os.path.split(path)
-    orig_name = name
-    for field_name, value in values.items():
-        orig = basil_tag_start + field_name + basil_tag_end
-        name = name.replace(orig, str(value))
-    if name != orig_name:
-        os.rename(join(directory, orig_name), join(directory, name))
-
-def populate_templates(project_directory, values):
-    # Rewrite/rename files (replacing basil tags).
-    to_process_rewrite = []
-    to_process_rename = []
-    # Topdown false, so that we will work on subdirectories first, which we need
-    # in order to rename effectively.
-    for root, dirs, files in os.walk(project_directory, topdown=False):
-        for path in [ join(root, name) for name in files ]:
-            try:
-                process_rewrite(path, values)
-            except Exception as e:
-                raise Exception("Problem rewriting \"{}\" with values: {}"
-                    .format(path, values))
-        for path in  [ join(root, name) for name in files + dirs ]:
-            try:
-                process_rename(path, values)
-            except Exception as e:
-                raise Exception("Problem renaming \"{}\" with values: {}"
-                    .format(path, values))
+    if basil_tag_start in rel_path:
+        for field_name, value in values.items():
+            rel_path = rel_path.replace(basil_tag_start + field_name
+                + basil_tag_end, str(value))
+    return rel_path
+
+def clone_file(src_path, dest_path, copy_mode):
+    """
+    Put a copy of src_path at dest_path - as a reflink or hardlink if
+    copy_mode asks (see settings.project_copy_mode), otherwise (or if that
+    can't be done) a plain copy.
+
+    Returns the copy mode actually used.
+    """
+    if copy_mode == keys.COPY_MODE_REFLINK and fcntl:
+        try:
+            with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            return keys.COPY_MODE_REFLINK
+        except OSError:
+            pass # not supported here e.g. ext4, or across filesystems
+    elif copy_mode == keys.COPY_MODE_HARDLINK:
+        try:
+            os.link(src_path, dest_path)
+            return keys.COPY_MODE_HARDLINK
+        except OSError:
+            pass
+    shutil.copyfile(src_path, dest_path)
+    return keys.COPY_MODE_COPY
+
+def instantiate_manifest(template_name, manifest, project_directory, values,
+        timer=None):
+    """
+    Make project_directory from the template in one pass - folders and files
+    are created under their final (rendered) names and only files with tags
+    are rendered. Everything else is cloned as is (see clone_file) - falling
+    back to plain copies for the rest of the project as soon as cloning fails.
+    Folders are made first (parents before children) then the files are done
+    in parallel (see run_in_pool).
+    values dict -- may have numbers (e.g. port) as vals
+
+    Returns the timings of each phase - see PhaseTimer.
+    """
+    timer = timer or PhaseTimer()
+    base_directory = join(templates_dir, template_name, keys.PROJECT_BASE)
+    copy_mode = settings.project_copy_mode
+    replacements = tag_replacements(values)
+    def dest_path(rel_path):
+        if not rel_path:
+            return project_directory
+        return join(project_directory, *render_path(rel_path, values).split("/"))
+    with timer.phase("dirs"):
+        for entry in manifest["dirs"]:
+            path = dest_path(entry["path"])
+            if entry["path"]:
+                os.mkdir(path)
+            else:
+                os.makedirs(path)
+            os.chmod(path, entry["mode"])
+    def make_file(entry):
+        nonlocal copy_mode
+        src_path = join(base_directory, *entry["path"].split("/"))
+        path = dest_path(entry["path"])
+        tags = entry["tags"]
+        if tags and not replacements.keys().isdisjoint(tag.encode('utf-8',
+                'surrogateescape') for tag in tags):
+            with open(src_path, 'rb') as src, open(path, 'wb') as dest:
+                render_stream(src, dest, replacements)
+        else:
+            copy_mode = clone_file(src_path, path, copy_mode)
+            if copy_mode == keys.COPY_MODE_HARDLINK:
+                return # same file as the template's so mode already right
+        os.chmod(path, entry["mode"])
+    with timer.phase("files"):
+        run_in_pool(make_file, manifest["files"])
+    return timer.timings
 
 def create_project_config(template_name, values, ports, project_directory):
     """
@@ -363,6 +837,8 @@ def create(template_name, values):
     * Copies the "vagrant template" *inside* templates_directory/template_name to projects_directory
     * "Fill in the blanks" of the new project directory with values.
     * Place a '.basil' json file in the project, containing values, the template name, and an initial state?
+
+    Returns how long each phase of creation took - see PhaseTimer.
     """
     # testing
     skip_creation = False
@@ -371,50 +847,203 @@ def create(template_name, values):
         time.sleep(2)
         print("*"*20 + " Skipping creation for test purposes. Set skip_creation"
             "to False later!!! " + "*"*20)
-        return
-    # Validation
-    errors = validate_fields(template_name, values)
-    if errors:
-      raise Exception(errors)
-    # Post-processing
-    template_lib = template_load_lib(template_name)
-    if template_lib:
-        process_func = template_lib.__dict__.get(keys.TEMPLATE_CONFIG_PROCESS)
-        if process_func:
-            process_func(values)
+        return OrderedDict()
+    timer = PhaseTimer()
+    prepare_values(template_name, values, timer)
     project_name = values[keys.PROJECT_NAME]
-    # Get ports
-    ports = get_ports(template_name)
-    # Copy vagrant template
     project_directory = join(projects_dir, project_name)
     if os.path.exists(project_directory):
         raise Exception("The \"{}\" project already exists so either "
             "\"Destroy Project\" or choose another name".format(project_name))
+    # Get ports
+    with timer.phase("ports"):
+        ports = get_ports(template_name, project_name)
+    make_project(template_name, values, ports, timer)
+    return timer.timings
+
+def prepare_values(template_name, values, timer):
+    """
+    Validate the values (raising an Exception holding the dict of errors if
+    there are any) then post-process them as the template's lib.py says.
+    """
+    # Validation
+    with timer.phase("validate"):
+        errors = validate_fields(template_name, values)
+    if errors:
+      raise Exception(errors)
+    # Post-processing
+    with timer.phase("process"):
+        template_lib = template_load_lib(template_name)
+        if template_lib:
+            process_func = template_lib.__dict__.get(
+                keys.TEMPLATE_CONFIG_PROCESS)
+            if process_func:
+                process_func(values)
+
+def make_project(template_name, values, ports, timer, manifest=None):
+    """
+    Build the project (see build_project) using the ports reserved for it -
+    keeping them if it works and releasing them if not.
+    """
+    project_name = values[keys.PROJECT_NAME]
     try:
-        shutil.copytree(join(templates_dir, template_name, keys.PROJECT_BASE),
-            project_directory)
+        build_project(template_name, values, ports,
+            join(projects_dir, project_name), timer, manifest)
+    except Exception:
+        port_allocator.release(project_name)
+        raise
+    port_allocator.confirm(project_name)
+    project_catalogue.refresh(project_name)
+    # wakes anyone waiting for status changes (see StatusCache) right away
+    status_cache.invalidate(project_name)
+
+def create_error(e):
+    """
+    What to report for an exception raised while creating a project - the dict
+    of field errors for validation failures, otherwise the message.
+    """
+    if e.args and isinstance(e.args[0], dict):
+        return e.args[0]
+    return str(e)
+
+def create_many(template_name, values_list):
+    """
+    Create several projects from one template e.g. identical workspaces for a
+    training session. values_list holds a values dict per project (as for
+    create).
+
+    Every set of values is validated and post-processed before anything is
+    made, ports for all the projects are allocated in one pass, and then the
+    projects are built concurrently (settings.create_workers at once) from the
+    one manifest. A project that fails doesn't stop the rest.
+
+    Returns a result dict per values dict, in the same order, with
+    project_name, created (True or False), error (None, a message, or a dict
+    of field errors) and timings (see create).
+    """
+    results = []
+    to_create = OrderedDict() # project_name: (values, result, timer)
+    for values in values_list:
+        result = {keys.PROJECT_NAME: values.get(keys.PROJECT_NAME),
+            "created": False, "error": None, "timings": None}
+        results.append(result)
+        timer = PhaseTimer()
+        try:
+            prepare_values(template_name, values, timer)
+            project_name = values[keys.PROJECT_NAME]
+            if project_name in to_create:
+                raise Exception("The \"{}\" project is in this batch more "
+                    "than once".format(project_name))
+            if os.path.exists(join(projects_dir, project_name)):
+                raise Exception("The \"{}\" project already exists so either "
+                    "\"Destroy Project\" or choose another name".format(
+                    project_name))
+        except Exception as e:
+            result["error"] = create_error(e)
+            continue
+        result[keys.PROJECT_NAME] = project_name
+        result["timings"] = timer.timings
+        to_create[project_name] = (values, result, timer)
+    if not to_create:
+        return results
+    try:
+        manifest = get_manifest(template_name)
+        port_tags = template_load_config(template_name).get(
+            keys.TEMPLATE_CONFIG_PORTS, [])
     except Exception as e:
-        raise Exception("Unable to create project from template \"{}\". "
-            "Original error: {}".format(template_name, e))
-    # Rewrite/rename files (replacing basil tags).
+        for unused, result, unused in to_create.values():
+            result["error"] = ("Unable to create project from template \"{}\". "
+                "Original error: {}".format(template_name, e))
+        return results
+    allocated, failed = port_allocator.allocate_many(list(to_create),
+        port_tags)
+    for project_name, error in failed.items():
+        to_create.pop(project_name)[1]["error"] = error
+    def make(project_name):
+        values, result, timer = to_create[project_name]
+        try:
+            make_project(template_name, values, allocated[project_name], timer,
+                manifest)
+            result["created"] = True
+        except Exception as e:
+            result["error"] = create_error(e)
+    n_workers = max(1, min(settings.create_workers, len(to_create)))
+    with futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for unused in executor.map(make, list(to_create)):
+            pass
+    return results
+
+def build_project(template_name, values, ports, project_directory,
+        timer=None, manifest=None):
+    """
+    Make the project folder from the template (using manifest if supplied, as
+    get_manifest would) and fill it in.
+
+    The project is built in a staging folder alongside the projects (so on the
+    same filesystem) and only renamed into place, in one go, once it is
+    complete. Anything listing projects never sees a half-made one and a
+    failure only has the staging folder to clear away.
+    """
+    timer = timer or PhaseTimer()
+    staging_directory = join(os.path.dirname(project_directory),
+        keys.BASIL_STAGING_DIR, "{}.{}".format(
+        os.path.basename(project_directory), uuid.uuid4().hex))
+    # Copy vagrant template, rewriting/renaming files (replacing basil tags).
     rewrite_values = values.copy()
     rewrite_values.update(ports)
     try:
-        populate_templates(project_directory, rewrite_values)
-    except Exception as e:
-        shutil.rmtree(project_directory)
-        raise e
-    # Create internal basil config file (.basil)
-    try:
-        create_project_config(template_name, values, ports, project_directory)
+        try:
+            if manifest is None:
+                with timer.phase("manifest"):
+                    manifest = get_manifest(template_name)
+            instantiate_manifest(template_name, manifest, staging_directory,
+                rewrite_values, timer)
+        except Exception as e:
+            raise Exception("Unable to create project from template \"{}\". "
+                "Original error: {}".format(template_name, e))
+        # Create internal basil config file (.basil)
+        try:
+            with timer.phase("config"):
+                create_project_config(template_name, values, ports,
+                    staging_directory)
+        except Exception:
+            raise Exception("Unable to create project configuration file ({}) "
+                "so project not created.".format(keys.BASIL_INTERNAL_CONFIG))
+        try:
+            with timer.phase("publish"):
+                os.rename(staging_directory, project_directory)
+        except OSError as e:
+            raise Exception("Unable to move the new project into place. "
+                "Original error: {}".format(e))
     except Exception:
-        shutil.rmtree(project_directory)
-        raise Exception("Unable to create project configuration file ({}) "
-            "so project not created.".format(keys.BASIL_INTERNAL_CONFIG))
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        raise
 
-def get_project_info(project_name):
+def sweep_staging(projects_directory=None):
+    """
+    Remove anything left in the staging folder (see build_project) e.g. by a
+    crash part way through creating a project. Only call at startup, before any
+    projects are being created.
+    """
+    staging_root = join(projects_directory or projects_dir,
+        keys.BASIL_STAGING_DIR)
     try:
-        project_config = project_load_config(project_name)
+        names = os.listdir(staging_root)
+    except OSError:
+        return
+    for name in names:
+        path = join(staging_root, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def read_project_info(project_name, config_path):
+    try:
+        project_config = load_config(config_path)
         template_name = project_config[keys.PROJECT_TEMPLATE_NAME]
         template_version = project_config[keys.PROJECT_TEMPLATE_VERSION]
         ports = project_config[keys.PROJECT_PORTS]
@@ -426,44 +1055,299 @@ def get_project_info(project_name):
         raise Exception("Unable to get project details for \"{}\" "
             "project. {}".format(project_name, e))
 
+
+class ProjectCatalogue(object):
+    """
+    In-memory ProjectInfos for the projects in projects_directory.
+
+    Each project's .basil is only read again when its mtime (or size) has
+    changed, so listing projects costs a directory listing and a stat per
+    project rather than parsing every config. create and destroy_project
+    update the catalogue as they go. Folders starting with "." are basil's own
+    and aren't projects.
+    """
+
+    def __init__(self, projects_directory):
+        self.projects_directory = projects_directory
+        self._entries = {} # project_name: (config signature, ProjectInfo)
+        self._lock = Lock()
+
+    def _config_path(self, project_name):
+        return join(self.projects_directory, project_name,
+            keys.BASIL_INTERNAL_CONFIG)
+
+    def get(self, project_name):
+        config_path = self._config_path(project_name)
+        try:
+            config_stat = os.stat(config_path)
+        except OSError as e:
+            self.discard(project_name)
+            raise Exception("Unable to get project details for \"{}\" "
+                "project. {}".format(project_name, e))
+        signature = (config_stat.st_mtime_ns, config_stat.st_size)
+        with self._lock:
+            entry = self._entries.get(project_name)
+        if entry and entry[0] == signature:
+            return entry[1]
+        project_info = read_project_info(project_name, config_path)
+        with self._lock:
+            self._entries[project_name] = (signature, project_info)
+        return project_info
+
+    def list(self):
+        project_names = sorted(x for x in os.listdir(self.projects_directory)
+            if not x.startswith(".")
+            and os.path.isdir(join(self.projects_directory, x)))
+        with self._lock:
+            for project_name in set(self._entries) - set(project_names):
+                del self._entries[project_name]
+        return [self.get(project_name) for project_name in project_names]
+
+    def refresh(self, project_name):
+        """
+        Re-read a project's config e.g. straight after creating it.
+        """
+        self.discard(project_name)
+        return self.get(project_name)
+
+    def discard(self, project_name):
+        with self._lock:
+            self._entries.pop(project_name, None)
+
+project_catalogue = ProjectCatalogue(projects_dir)
+
+def get_project_info(project_name):
+    return project_catalogue.get(project_name)
+
 def get_project_infos():
     """
     Returns a list of ProjectInfos for each project in projects_directory.
     When listing actions, always include the actions in default_actions.
     """
-    project_infos = []
-    project_names = [x for x in os.listdir(projects_dir)
-        if os.path.isdir(join(projects_dir, x))]
-    for project_name in project_names:
-        project_infos.append(get_project_info(project_name))
-    return project_infos
+    return project_catalogue.list()
 
-def get_project_statuses():
+
+class StatusCache(object):
     """
-    Get project statuses.
+    In-process store of ProjectStatuses keyed by project name.
+
+    Entries are fresh for ttl seconds (unknown statuses for unknown_ttl). With
+    stale_while_revalidate, an expired entry is still handed out (counted as a stale hit) and the caller is
+    expected to refresh it in the background. Entries must be invalidated
+    whenever basil changes a project's state e.g. after a vagrant command.
+
+    Every change to a stored status (or a project going away) bumps the
+    generation, so clients can ask what has changed since the generation they
+    last saw. Generations look like "<epoch>.<n>" - the epoch changes each
+    time basil starts so old generations are never mistaken for current
+    ones.
     """
-    project_infos = get_project_infos()
-    project_statuses = []
-    for project_info in project_infos:
-        project_statuses.append(get_project_status(
-            project_info.project_name,
-            project_info.template_name,
-            project_info.template_version))
-    return project_statuses
 
-def missing_virtualbox(project_directory):
+    def __init__(self, ttl, stale_while_revalidate=True, unknown_ttl=None):
+        self.ttl = ttl
+        self.unknown_ttl = ttl if unknown_ttl is None else unknown_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {} # project_name: (project_status, time stored)
+        # so statuses probed before an invalidation aren't stored after it
+        self._all_invalidations = 0
+        self._invalidations = {} # project_name: count
+        self._epoch = uuid.uuid4().hex[:8]
+        self._generation = 0
+        # project_name: (last project_status stored, generation it changed)
+        # - kept through invalidations so re-probing an unchanged project
+        # doesn't count as a change
+        self._changes = {}
+        self.updates = 0 # changes and invalidations - see wait_for_update
+        self._lock = Lock()
+        self._updated = Condition(self._lock)
+
+    def get(self, project_name):
+        """
+        Returns (project_status, is_fresh). project_status is None on a miss,
+        including when an entry has expired and stale entries aren't allowed.
+        """
+        with self._lock:
+            entry = self._entries.get(project_name)
+            if entry:
+                project_status, stored = entry
+                ttl = (self.unknown_ttl if project_status.state
+                    == keys.VAGRANT_STATUS_STATE_UNKNOWN else self.ttl)
+                if time.monotonic() - stored < ttl:
+                    self.hits += 1
+                    return project_status, True
+                if self.stale_while_revalidate:
+                    self.stale_hits += 1
+                    return project_status, False
+            self.misses += 1
+            return None, False
+
+    def invalidation_marker(self, project_name):
+        """
+        Take one before probing a project's status and pass it to put - the
+        status is dropped if the project has been invalidated in between.
+        """
+        with self._lock:
+            return (self._all_invalidations,
+                self._invalidations.get(project_name, 0))
+
+    def put(self, project_status, invalidation_marker=None):
+        """
+        Store project_status unless the project has been invalidated since
+        invalidation_marker was taken (the status could be out of date e.g.
+        probed while a command was finishing). Returns False if dropped.
+        """
+        with self._lock:
+            project_name = project_status.project_name
+            if invalidation_marker is not None and invalidation_marker != (
+                    self._all_invalidations,
+                    self._invalidations.get(project_name, 0)):
+                return False
+            self._entries[project_name] = (project_status, time.monotonic())
+            last_status, unused = self._changes.get(project_name, (None, None))
+            if project_status != last_status:
+                self._generation += 1
+                self._changes[project_name] = (project_status,
+                    self._generation)
+                self._notify()
+            return True
+
+    def invalidate(self, project_name=None):
+        """
+        Drop the entry for project_name (or all entries if None).
+        """
+        with self._lock:
+            self.invalidations += 1
+            if project_name is None:
+                self._all_invalidations += 1
+                self._entries.clear()
+            else:
+                self._invalidations[project_name] = (
+                    self._invalidations.get(project_name, 0) + 1)
+                self._entries.pop(project_name, None)
+            self._notify()
+
+    def retain(self, project_names):
+        """
+        Drop entries for projects which no longer exist.
+        """
+        project_names = set(project_names)
+        with self._lock:
+            for project_name in set(self._entries) - project_names:
+                del self._entries[project_name]
+            gone = set(self._changes) - project_names
+            if gone:
+                for project_name in gone:
+                    del self._changes[project_name]
+                self._generation += 1
+                self._notify()
+
+    def _notify(self):
+        """
+        Wake anyone waiting for an update. Must hold the lock.
+        """
+        self.updates += 1
+        self._updated.notify_all()
+
+    @property
+    def generation(self):
+        with self._lock:
+            return "{}.{}".format(self._epoch, self._generation)
+
+    def generation_of(self, project_statuses):
+        """
+        The current generation if project_statuses are the latest stored for
+        every project (so whoever has them is up to date), otherwise None.
+        """
+        with self._lock:
+            project_names = set()
+            for project_status in project_statuses:
+                project_names.add(project_status.project_name)
+                last_status, unused = self._changes.get(
+                    project_status.project_name, (None, None))
+                if project_status != last_status:
+                    return None
+            if project_names != set(self._changes):
+                return None
+            return "{}.{}".format(self._epoch, self._generation)
+
+    def changed_since(self, generation, project_names=()):
+        """
+        Returns the names of projects whose status has changed since
+        generation, or None if generation isn't one of ours (treat everything
+        as changed). Any of project_names with no status stored are included
+        too - the client can't have seen their status.
+        """
+        try:
+            epoch, n = generation.split(".")
+            n = int(n)
+        except (AttributeError, ValueError):
+            return None
+        with self._lock:
+            if epoch != self._epoch or n > self._generation:
+                return None
+            changed = {project_name for project_name, (unused, changed)
+                in self._changes.items() if changed > n}
+            changed.update(set(project_names) - set(self._changes))
+            return changed
+
+    def wait_for_update(self, updates, timeout):
+        """
+        Wait until there has been an update (a change or an invalidation)
+        since updates was read. Returns False if it timed out.
+        """
+        with self._updated:
+            return self._updated.wait_for(lambda: self.updates != updates,
+                timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "generation": "{}.{}".format(self._epoch, self._generation),
+                "ttl": self.ttl,
+                "unknown_ttl": self.unknown_ttl,
+                "stale_while_revalidate": self.stale_while_revalidate,
+            }
+
+status_cache = StatusCache(settings.status_cache_ttl,
+    settings.status_cache_stale_while_revalidate,
+    settings.status_cache_unknown_ttl)
+
+def cache_project_statuses(project_statuses, invalidation_markers=None):
     """
-    --machine-readable at end of vagrant status prevents message being output
-    when VB not detected
+    Unknown statuses are kept too, but only briefly (see StatusCache) - so a
+    hung project isn't probed again by every request.
+
+    invalidation_markers -- maps project names to the
+    status_cache.invalidation_marker taken before probing them.
     """
-    try:
-        p = subprocess.Popen(["vagrant", "status"], stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE, cwd=project_directory)
-        unused, err = p.communicate()
-        missing = b"could not detect VirtualBox!" in err
-    except Exception:
-        missing = False
-    return missing
+    invalidation_markers = invalidation_markers or {}
+    for project_status in project_statuses:
+        status_cache.put(project_status,
+            invalidation_markers.get(project_status.project_name))
+
+def refresh_project_statuses(project_infos):
+    """
+    Re-probe project statuses in the background (for stale cache entries).
+    Projects already being probed aren't probed again.
+    """
+    import async_core
+    async_core.submit(async_core.refresh_project_statuses(project_infos))
+
+def get_project_statuses(use_cache=True):
+    """
+    See async_core.get_project_statuses.
+    """
+    import async_core
+    return async_core.run(async_core.get_project_statuses(use_cache))
 
 def extract_status_dets(output):
     status_dict = {}
@@ -481,64 +1365,102 @@ def extract_status_dets(output):
             status_dict[keys.VAGRANT_STATUS_STATE_HUMAN_LONG] = data
     return status_dict
 
-def get_project_status_via_vagrant(project_name, template_name,
-        template_version):
+def get_unknown_status(project_name, template_name, template_version, msg):
     """
+    Status for a project whose state couldn't be determined. Used when the
+    failure is isolated to that project.
+    """
+    return ProjectStatus(project_name, template_name, template_version,
+        keys.VAGRANT_STATUS_STATE_UNKNOWN, "Unable to get status", msg, None,
+        True)
+
+def read_vagrant_status(project_name, template_name, template_version,
+        output):
+    """
+    Make the ProjectStatus from the output of vagrant status
+    --machine-readable.
     http://docs.vagrantup.com/v2/cli/machine-readable.html
     Note - API not stabilised yet, and vagrant 1.4 onwards only.
-
-    Fail hard if prerequisites for _any_ status checks are missing.
-
-    Return response in usual format if potentially a failure isolated to
-    a particular project. Use VAGRANT_STATUS_STATE_UNKNOWN.
     """
-    project_directory = join(projects_dir, project_name)
-    try:
-        output = str(subprocess.check_output(["vagrant", "status",
-            "--machine-readable"], cwd=project_directory), "utf-8")
-    except FileNotFoundError as e:
-        raise Exception("Unable to get project status using vagrant. Is "
-            "vagrant installed on this machine?")
-    except Exception as e:
-        if missing_virtualbox(project_directory):
-            raise Exception("VirtualBox needs to be installed before you "
-                "can use Basil")
-        else:
-            return ProjectStatus(project_name, template_name,
-                template_version, keys.VAGRANT_STATUS_STATE_UNKNOWN,
-                "Unable to get status",
-                "Problem getting project status. {}".format(e), None,
-                True)
     status_dict = extract_status_dets(output)
-    project_config = project_load_config(project_name)
-    webserver_port = project_config[keys.PROJECT_PORTS].get(
-        keys.TEMPLATE_CONFIG_WEBSERVER_PORT, 8888)
-    allow_destroy = project_config.get(keys.PROJECT_ALLOW_DESTROY, True)
     try:
-        project_status = ProjectStatus(project_name, template_name,
+        project_status = make_project_status(project_name, template_name,
             template_version,
             status_dict[keys.VAGRANT_STATUS_STATE],
             status_dict[keys.VAGRANT_STATUS_STATE_HUMAN_SHORT],
-            status_dict[keys.VAGRANT_STATUS_STATE_HUMAN_LONG],
-            webserver_port, allow_destroy)
+            status_dict[keys.VAGRANT_STATUS_STATE_HUMAN_LONG])
     except KeyError as e:
         raise Exception("Unable to get project status for \"{}\"."
-            "\nOriginal error: {}".format(project_directory, e))
+            "\nOriginal error: {}".format(join(projects_dir, project_name), e))
     return project_status
 
+def make_project_status(project_name, template_name, template_version, state,
+        state_human_short, state_human_long):
+    """
+    Fill in the parts of a ProjectStatus which come from the project config.
+    """
+    project_info = get_project_info(project_name)
+    webserver_port = project_info.ports.get(
+        keys.TEMPLATE_CONFIG_WEBSERVER_PORT, 8888)
+    return ProjectStatus(project_name, template_name, template_version, state,
+        state_human_short, state_human_long, webserver_port,
+        project_info.allow_destroy)
+
+def read_machine_ids(project_name):
+    """
+    Vagrant records the provider's id for each machine it has created in
+    .vagrant/machines/<machine>/<provider>/id. The provider directory exists
+    without an id file once the machine has been destroyed.
+
+    Returns a dict mapping (machine, provider) to the id (None if no id file).
+    """
+    machines_dir = join(projects_dir, project_name, keys.VAGRANT_DOT_DIR,
+        keys.VAGRANT_MACHINES_DIR)
+    machine_ids = {}
+    try:
+        machines = os.listdir(machines_dir)
+    except OSError:
+        return machine_ids
+    for machine in machines:
+        machine_dir = join(machines_dir, machine)
+        if not os.path.isdir(machine_dir):
+            continue
+        for provider in os.listdir(machine_dir):
+            if not os.path.isdir(join(machine_dir, provider)):
+                continue
+            try:
+                with open(join(machine_dir, provider, keys.VAGRANT_MACHINE_ID),
+                        'r') as f:
+                    machine_id = f.read().strip() or None
+            except OSError:
+                machine_id = None
+            machine_ids[(machine, provider)] = machine_id
+    return machine_ids
+
+def missing_virtualbox(project_directory):
+    """
+    See async_core.missing_virtualbox.
+    """
+    import async_core
+    return async_core.run(async_core.missing_virtualbox(project_directory))
+
+def get_project_status_via_vagrant(project_name, template_name,
+        template_version):
+    """
+    See async_core.get_project_status_via_vagrant. Template lib.py status
+    functions can fall back on this.
+    """
+    import async_core
+    return async_core.run(async_core.get_project_status_via_vagrant(
+        project_name, template_name, template_version))
+
 def get_project_status(project_name, template_name, template_version):
     """
-    Uses lib.py version if available, otherwise default approach using vagrant.
+    See async_core.get_project_status.
     """
-    template_lib = template_load_lib(template_name)
-    project_status_func = None
-    if template_lib:
-        project_status_func = (template_lib.__dict__
-            .get(keys.PROJECT_STATUS_FUNCNAME))
-    if not project_status_func:
-        project_status_func = get_project_status_via_vagrant
-    return project_status_func(project_name, template_name,
-        template_version)
+    import async_core
+    return async_core.run(async_core.get_project_status(project_name,
+        template_name, template_version))
 
 def get_port_forwarded_collision_msg(cmd, error):
     forwarded_collision_result_pattern = (r"The forwarded port to (\d{4,5}) "
@@ -585,103 +1507,704 @@ def execute_blocking_vagrant_cmd(command_list, project_directory,
 
     If no transformations of the error message occur we use the cmd and the
     raw error to form a basic error message.
+
+    Runs on async_core's event loop - see async_core.execute_vagrant_cmd.
     """
-    cmd = " ".join(command_list)
-    try:
-        p = subprocess.Popen(command_list, cwd=project_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except FileNotFoundError as e:
-        command_progress.state = keys.CommandProgressStates.ERROR
-        msg = ("Problem running vagrant command {}. Is vagrant even installed "
-            "on this machine? Error: {}".format(cmd, e))
-        command_progress.error = msg
+    import async_core
+    async_core.run(async_core.execute_vagrant_cmd(command_list,
+        project_directory, command_progress, msg_transformer, callback))
+
+def vagrant_cmd_not_found(cmd, e, command_progress):
+    msg = ("Problem running vagrant command {}. Is vagrant even installed "
+        "on this machine? Error: {}".format(cmd, e))
+    command_progress.set_state(keys.CommandProgressStates.ERROR, msg)
+    raise Exception(msg)
+
+def handle_vagrant_output_line(command_progress, output_line, msg_transformer,
+        error_lines):
+    """
+    stderr lines are kept in error_lines (a bounded deque) for the error
+    message. Non-blank stdout lines count as progress and are turned into
+    summary and details by msg_transformer (if any).
+    """
+    if output_line.stream == STDERR:
+        error_lines.append(output_line.text)
+        return
+    msg = output_line.text.strip()
+    if not msg:
+        return
+    command_progress.add_progress()
+    if msg_transformer:
+        summary, details = msg_transformer(msg)
+    else:
+        summary, details = None, msg
+    if summary:
+        command_progress.set_summary(summary)
+    if details:
+        command_progress.add_details(details, output_line.timestamp)
+
+def finish_vagrant_cmd(cmd, returncode, error_lines, command_progress,
+        callback=None):
+    """
+    Set the final state of a vagrant command which has exited - raising an
+    Exception if it failed. Runs callback (if any) first if it worked.
+    """
+    if command_progress.cancel_requested:
+        command_progress.set_state(keys.CommandProgressStates.CANCELLED)
+        return
+    error = "\n".join(error_lines).strip()
+    if not error and returncode != 0:
+        error = "exited with status {}".format(returncode)
+    if error:
+        msg = None
+        error_transforms = [get_port_forwarded_collision_msg, ]
+        for error_transform in error_transforms:
+            transformed_msg = error_transform(cmd, error)
+            if transformed_msg:
+                msg = transformed_msg
+                break
+        if not msg:
+            msg = "Command \"{}\" failed. Reason: {}".format(cmd, error)
+        command_progress.set_state(keys.CommandProgressStates.ERROR, msg)
         raise Exception(msg)
-    while True:
-        if p.poll() == None:
-            while True:
-                command_progress.progress += 1;
-                msg = str(p.stdout.readline(), "utf-8").strip()
-                if not msg:
-                    break
-                if msg_transformer:
-                    summary, details = msg_transformer(msg)
-                else:
-                    summary, details = None, msg
-                if not summary:
-                    summary = command_progress.summary
-                if not details:
-                    details = command_progress.details
-                command_progress.summary = summary;
-                command_progress.details += details + "\n"
-            error = str(p.stderr.read(), "utf-8").strip()
-            if error:
-                msg = None
-                error_transforms = [get_port_forwarded_collision_msg, ]
-                for error_transform in error_transforms:
-                    transformed_msg = error_transform(cmd, error)
-                    if transformed_msg:
-                        msg = transformed_msg
-                        break
-                if not msg:
-                    msg = "Command \"{}\" failed. Reason: {}".format(cmd, error)
-                command_progress.state = keys.CommandProgressStates.ERROR
-                command_progress.error = msg
-                raise Exception(msg)
+    # before FINISHED so anyone acting on that sees the end result
+    if callback:
+        # the log may be in the project folder (which destroy removes) -
+        # Windows won't delete an open file
+        command_progress.close_output()
+        try:
+            callback()
+        except Exception as e:
+            msg = ("Command \"{}\" ran but tidying up afterwards failed. "
+                "Reason: {}".format(cmd, e))
+            command_progress.set_state(keys.CommandProgressStates.ERROR, msg)
+            raise Exception(msg)
+    command_progress.set_state(keys.CommandProgressStates.FINISHED)
+
+def split_output_lines(stream, pending, chunk):
+    """
+    Add chunk (bytes) to what is pending for stream. Returns (OutputLines,
+    still pending). Overlong lines are split so pending stays bounded.
+    """
+    timestamp = time.time()
+    raw_lines = (pending + chunk).split(b"\n")
+    pending = raw_lines.pop()
+    while len(pending) > max_output_line_length:
+        raw_lines.append(pending[:max_output_line_length])
+        pending = pending[max_output_line_length:]
+    return ([OutputLine(timestamp, stream, str(raw_line, "utf-8",
+        "replace").rstrip("\r")) for raw_line in raw_lines], pending)
+
+def interrupt_process(p):
+    """
+    Stop a vagrant process as if Ctrl-C had been pressed so it can tidy up
+    after itself.
+    """
+    try:
+        if my_platform == WINDOWS:
+            p.terminate()
         else:
-            command_progress.state = keys.CommandProgressStates.FINISHED
-            if callback:
-                callback()
-            break
+            p.send_signal(signal.SIGINT)
+    except OSError:
+        pass # already finished
 
 
 class CommandProgress(object):
+    """
+    Progress of a vagrant command. Change it through the setters so observers
+    are told about each change as a ProgressEvent - only what changed (e.g. a
+    new line of details) rather than the whole thing.
+
+    Observers must have an update(command_progress, event) method. They are
+    called from the thread running the command so must be quick.
+    """
 
     class JSONEncoder(json.JSONEncoder):
         def default(self, command_progress):
-            return {
-                keys.PROGRESS_STATE: command_progress.state.value,
-                keys.PROGRESS_PROGRESS: command_progress.progress,
-                keys.PROGRESS_SUMMARY: command_progress.summary,
-                keys.PROGRESS_DETAILS: command_progress.details,
-                keys.PROGRESS_ERROR: command_progress.error,
-            }
-
-    def __init__(self):
+            return command_progress.as_dict()
+
+    def __init__(self, command="", project_name=None, log_dir=None):
+        """
+        log_dir -- if supplied, the command's output is also logged to a file
+        there (named after the command id).
+        """
+        self.command_id = uuid.uuid4().hex
+        self.command = command
+        self.project_name = project_name
+        self.started = time.time()
+        self.finished = None
+        self.queue_position = None # only while QUEUED. 1 is next to run
+        self.process = None # while running
+        self.cancel_requested = False
         self.state = keys.CommandProgressStates.ACTIVE
         self.progress = 0
         self.summary = "In progress"
-        self.details = ""
+        log_path = (join(log_dir, self.command_id + command_log_ext)
+            if log_dir else None)
+        self.output = CommandOutputLog(settings.progress_max_lines, log_path)
         self.error = ""
         self.observers = []
+        self.lock = RLock()
+
+    def summary_dict(self):
+        """
+        Everything except the details (which can be long).
+        """
+        with self.lock:
+            return {
+                keys.PROGRESS_COMMAND_ID: self.command_id,
+                keys.PROGRESS_COMMAND: self.command,
+                keys.PROGRESS_PROJECT_NAME: self.project_name,
+                keys.PROGRESS_STARTED: self.started,
+                keys.PROGRESS_FINISHED: self.finished,
+                keys.PROGRESS_STATE: self.state.value,
+                keys.PROGRESS_QUEUE_POSITION: self.queue_position,
+                keys.PROGRESS_PROGRESS: self.progress,
+                keys.PROGRESS_SUMMARY: self.summary,
+                keys.PROGRESS_ERROR: self.error,
+            }
+
+    @property
+    def is_done(self):
+        return self.state in done_progress_states
+
+    @property
+    def details(self):
+        """
+        The lines of output still held in memory.
+        """
+        with self.lock:
+            return "".join(text + "\n" for unused, text
+                in self.output.read(self.output.first_offset)[1])
+
+    def read_details(self, offset=0, limit=None):
+        """
+        See CommandOutputLog.read
+        """
+        return self.output.read(offset, limit)
 
     def addObserver(self, observer):
-        if observer not in self.observers:
-            self.observers.append(observer)
+        with self.lock:
+            if observer not in self.observers:
+                self.observers.append(observer)
 
-    def notifyObservers(self):
+    def removeObserver(self, observer):
+        with self.lock:
+            if observer in self.observers:
+                self.observers.remove(observer)
+
+    def notifyObservers(self, event):
         for observer in self.observers:
-            observer.update(self)
+            observer.update(self, event)
+
+    def subscribe(self, observer):
+        """
+        Add observer and return a list of ProgressEvents describing everything
+        so far. Nothing can change in between so the observer sees every change
+        exactly once (either in the snapshot or as an update).
+        """
+        with self.lock:
+            self.addObserver(observer)
+            snapshot = [
+                ProgressEvent(keys.PROGRESS_SUMMARY, self.summary),
+                ProgressEvent(keys.PROGRESS_QUEUE_POSITION,
+                    self.queue_position),
+                ProgressEvent(keys.PROGRESS_PROGRESS, self.progress),
+            ]
+            offset, lines = self.output.read(self.output.first_offset)
+            if lines:
+                snapshot.append(ProgressEvent(keys.PROGRESS_DETAILS,
+                    details_event_data(offset, lines)))
+            # last so a finished command's snapshot ends with its final state
+            snapshot.append(ProgressEvent(keys.PROGRESS_STATE,
+                self.state_data()))
+            return snapshot
+
+    def state_data(self):
+        return {
+            keys.PROGRESS_STATE: self.state.value,
+            keys.PROGRESS_ERROR: self.error,
+        }
+
+    def add_progress(self, amount=1):
+        with self.lock:
+            self.progress += amount
+            self.notifyObservers(ProgressEvent(keys.PROGRESS_PROGRESS,
+                self.progress))
+
+    def set_summary(self, summary):
+        with self.lock:
+            if summary == self.summary:
+                return
+            self.summary = summary
+            self.notifyObservers(ProgressEvent(keys.PROGRESS_SUMMARY, summary))
+
+    def add_details(self, line, timestamp=None):
+        with self.lock:
+            if timestamp is None:
+                timestamp = time.time()
+            offset = self.output.line_count
+            self.output.append(timestamp, line)
+            self.notifyObservers(ProgressEvent(keys.PROGRESS_DETAILS,
+                details_event_data(offset, [(timestamp, line)])))
+
+    def set_state(self, state, error=""):
+        with self.lock:
+            self.state = state
+            self.error = error
+            if self.is_done:
+                self.finished = time.time()
+                self.process = None
+                self.output.close()
+            self.notifyObservers(ProgressEvent(keys.PROGRESS_STATE,
+                self.state_data()))
+
+    def close_output(self):
+        """
+        Close the output log. Only call once the command has stopped writing.
+        """
+        with self.lock:
+            self.output.close()
+
+    def set_queue_position(self, queue_position):
+        with self.lock:
+            if queue_position == self.queue_position:
+                return
+            self.queue_position = queue_position
+            self.notifyObservers(ProgressEvent(keys.PROGRESS_QUEUE_POSITION,
+                queue_position))
+
+    def request_cancel(self):
+        """
+        Interrupt the command's process if it has one. Otherwise it will be
+        interrupted as soon as it starts.
+        """
+        self.cancel_requested = True
+        process = self.process
+        if process:
+            interrupt_process(process)
+
+    def as_dict(self, details_offset=None):
+        """
+        details_offset -- only include details from this line onwards (as far
+        as what is held in memory allows). By default, all held in memory.
+        """
+        with self.lock:
+            progress_dict = self.summary_dict()
+            if details_offset is None:
+                details_offset = self.output.first_offset
+            offset, lines = self.output.read(max(details_offset,
+                self.output.first_offset))
+            progress_dict[keys.PROGRESS_DETAILS] = "".join(text + "\n"
+                for unused, text in lines)
+            progress_dict[keys.PROGRESS_DETAILS_OFFSET] = offset
+            progress_dict[keys.PROGRESS_LINE_COUNT] = self.output.line_count
+            return progress_dict
+
+    def to_json(self, details_offset=None):
+        return json.dumps(self.as_dict(details_offset))
+
+def details_event_data(offset, lines):
+    """
+    lines -- (timestamp, text) tuples starting at line offset.
+    """
+    return {
+        keys.PROGRESS_DETAILS_OFFSET: offset,
+        keys.PROGRESS_LINES: [text for unused, text in lines],
+        keys.PROGRESS_TIMES: [timestamp for timestamp, unused in lines],
+    }
+
+
+class CommandOutputLog(object):
+    """
+    The lines of output (details) from a command. Only the most recent
+    max_lines are held in memory. If there is a log_path, every line is also
+    appended there so older lines can still be read back.
+
+    Lines are addressed by offset - 0 for the command's first line. A file
+    position is remembered every checkpoint_every lines so reading older lines
+    doesn't mean reading the file from the start.
+
+    Thread-safe. Reading doesn't hold the lock while reading the log file.
+    """
+
+    checkpoint_every = 1000
+
+    def __init__(self, max_lines, log_path=None):
+        self.lines = deque(maxlen=max_lines) # (timestamp, text)
+        self.line_count = 0
+        self.log_path = log_path
+        self._log_file = None
+        self._checkpoints = []
+        self._lock = Lock()
+
+    @property
+    def first_offset(self):
+        """
+        Offset of the oldest line held in memory.
+        """
+        return self.line_count - len(self.lines)
+
+    def append(self, timestamp, text):
+        with self._lock:
+            if self.log_path:
+                self._log(timestamp, text)
+            self.lines.append((timestamp, text))
+            self.line_count += 1
+
+    def _log(self, timestamp, text):
+        """
+        If the log can't be written we carry on with memory only.
+        """
+        try:
+            if self._log_file is None:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                self._log_file = open(self.log_path, "ab")
+            if self.line_count % self.checkpoint_every == 0:
+                self._checkpoints.append(self._log_file.tell())
+            self._log_file.write("{}\t{}\n".format(timestamp, text)
+                .encode("utf-8"))
+        except (OSError, ValueError):
+            self._close()
+            self.log_path = None
+            self._checkpoints = []
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._log_file:
+            try:
+                self._log_file.close()
+            except OSError:
+                pass
+            self._log_file = None
+
+    def read(self, offset=0, limit=None):
+        """
+        Returns (offset, lines). lines are (timestamp, text) tuples starting at
+        the offset returned. That is later than the one asked for if the lines
+        asked for aren't available any more (not in memory and not logged).
+
+        The log file is read without holding the lock so a slow disk doesn't
+        hold up the command writing its output.
+        """
+        offset = max(0, offset)
+        with self._lock:
+            if offset >= self.first_offset or not self._checkpoints:
+                return self._read_memory(offset, limit)
+            end = self.line_count
+            if limit is not None:
+                end = min(end, offset + limit)
+            stop = min(end, self.first_offset)
+            checkpoint = offset // self.checkpoint_every
+            position = self._checkpoints[checkpoint]
+            skip = offset - checkpoint*self.checkpoint_every
+            log_path = self.log_path
+            try:
+                if self._log_file:
+                    self._log_file.flush()
+            except (OSError, ValueError):
+                pass
+        lines = self._read_log(log_path, position, skip, stop - offset)
+        with self._lock:
+            if lines is None:
+                self._checkpoints = []
+                return self._read_memory(offset, limit)
+            first_offset = self.first_offset
+            # anything between stop and first_offset has just gone from memory
+            # - the caller asks again from where these lines end
+            if end > stop and stop >= first_offset:
+                lines.extend(itertools.islice(self.lines,
+                    stop - first_offset, end - first_offset))
+        return offset, lines
+
+    def _read_memory(self, offset, limit):
+        first_offset = self.first_offset
+        offset = max(offset, first_offset)
+        end = self.line_count
+        if limit is not None:
+            end = min(end, offset + limit)
+        return offset, list(itertools.islice(self.lines,
+            offset - first_offset, end - first_offset))
+
+    @staticmethod
+    def _read_log(log_path, position, skip, count):
+        """
+        Read count lines from log_path, skipping skip lines from position.
+        Returns None if the log can't be read any more (e.g. pruned, or the
+        project destroyed) - only the lines in memory are available from then
+        on.
+        """
+        lines = []
+        try:
+            with open(log_path, "rb") as f:
+                f.seek(position)
+                for unused in range(skip):
+                    f.readline()
+                for unused in range(count):
+                    timestamp, text = str(f.readline(), "utf-8").rstrip(
+                        "\n").split("\t", 1)
+                    lines.append((float(timestamp), text))
+        except (OSError, ValueError):
+            return None
+        return lines
+
+def prune_command_logs(log_dir, keep):
+    """
+    Only keep the most recent command logs in a project's log folder.
+    """
+    try:
+        log_names = [x for x in os.listdir(log_dir)
+            if x.endswith(command_log_ext)]
+    except OSError:
+        return
+    log_names.sort(key=lambda x: os.path.getmtime(join(log_dir, x)),
+        reverse=True)
+    for log_name in log_names[keep:]:
+        try:
+            os.remove(join(log_dir, log_name))
+        except OSError:
+            pass
 
-    def to_json(self):
-        return json.dumps(self, cls=self.JSONEncoder)
+def is_final_progress_event(event):
+    """
+    True if the event reports the command has finished (or failed).
+    """
+    return (event.kind == keys.PROGRESS_STATE and event.data[keys.PROGRESS_STATE]
+        in [state.value for state in done_progress_states])
+
+class ProgressEventQueue(object):
+    """
+    CommandProgress observer which queues up events for one consumer e.g. a
+    streaming HTTP response running in another thread.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def update(self, command_progress, event):
+        self.events.put(event)
+
+    def get(self, timeout=None):
+        """
+        Raises queue.Empty if nothing arrives within timeout seconds.
+        """
+        return self.events.get(timeout=timeout)
+
+
+class CommandRegistry(object):
+    """
+    Every vagrant command run by basil, by command id, so several commands can
+    be followed at once.
+
+    Queued and active commands are always kept. Finished ones are kept for
+    retention_seconds but no more than max_finished of them (most recently
+    finished kept).
+    """
+
+    def __init__(self, max_finished, retention_seconds):
+        self.max_finished = max_finished
+        self.retention_seconds = retention_seconds
+        self._commands = OrderedDict() # command_id: CommandProgress
+        self._lock = Lock()
+
+    def register(self, command_progress):
+        """
+        Keep track of command_progress under its command id.
+        """
+        with self._lock:
+            self._commands[command_progress.command_id] = command_progress
+            self._evict()
+        return command_progress.command_id
+
+    def get(self, command_id):
+        """
+        Returns None if unknown (or evicted).
+        """
+        with self._lock:
+            return self._commands.get(command_id)
+
+    def latest(self):
+        with self._lock:
+            if not self._commands:
+                return None
+            return next(reversed(self._commands.values()))
+
+    def list(self, active_only=False):
+        """
+        CommandProgresses, oldest first.
+        """
+        with self._lock:
+            self._evict()
+            return [command_progress for command_progress
+                in self._commands.values()
+                if not (active_only and command_progress.is_done)]
+
+    def _evict(self):
+        expire_before = time.time() - self.retention_seconds
+        finished = sorted((command_progress for command_progress
+            in self._commands.values() if command_progress.is_done),
+            key=lambda command_progress: command_progress.finished,
+            reverse=True)
+        for n, command_progress in enumerate(finished):
+            if (n >= self.max_finished
+                    or command_progress.finished < expire_before):
+                del self._commands[command_progress.command_id]
+
+command_registry = CommandRegistry(settings.command_retention_count,
+    settings.command_retention_seconds)
+
+class Job(object):
+    """
+    Something for the JobScheduler to run - normally a vagrant command. Its
+    progress is reported through command_progress.
+
+    priority -- one of keys.JOB_PRIORITY_*. Lower values run first.
+
+    is_boot -- boots (and reprovisions) are heavy on disk and CPU so have
+    their own concurrency limit.
+    """
 
+    def __init__(self, func, command_progress, priority, is_boot=False):
+        self.func = func
+        self.command_progress = command_progress
+        self.priority = priority
+        self.is_boot = is_boot
+        self.seq = None # set when submitted
+        self.done = Event()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+class JobScheduler(object):
+    """
+    Runs jobs in priority order (first come, first served within a priority).
+    No more than max_concurrent_jobs run at once, and no more than
+    max_concurrent_boots of those can be boots. A boot waiting for a boot slot
+    doesn't hold up jobs behind it which could run.
+
+    Queued jobs are QUEUED and have a queue position in their CommandProgress.
+    """
+
+    def __init__(self, max_concurrent_jobs, max_concurrent_boots):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_concurrent_boots = max_concurrent_boots
+        self._queued = []
+        self._running = []
+        self._seq = itertools.count()
+        self._lock = Lock()
+
+    def submit(self, job):
+        with self._lock:
+            job.seq = next(self._seq)
+            job.command_progress.set_state(keys.CommandProgressStates.QUEUED)
+            self._queued.append(job)
+            self._queued.sort(key=lambda queued_job: (queued_job.priority,
+                queued_job.seq))
+            self._dispatch()
+        return job
+
+    def cancel(self, command_id):
+        """
+        Cancel a queued job outright, or interrupt a running one. Returns False
+        if there is no such job (e.g. it has already finished).
+        """
+        with self._lock:
+            for job in self._queued:
+                if job.command_progress.command_id == command_id:
+                    self._queued.remove(job)
+                    job.command_progress.set_queue_position(None)
+                    job.command_progress.set_state(
+                        keys.CommandProgressStates.CANCELLED)
+                    job.done.set()
+                    self._dispatch()
+                    return True
+            for job in self._running:
+                if job.command_progress.command_id == command_id:
+                    job.command_progress.request_cancel()
+                    return True
+        return False
+
+    def _dispatch(self):
+        """
+        Start whatever can be started. Must hold the lock.
+        """
+        n_boots = len([job for job in self._running if job.is_boot])
+        for job in list(self._queued):
+            if len(self._running) >= self.max_concurrent_jobs:
+                break
+            if job.is_boot and n_boots >= self.max_concurrent_boots:
+                continue
+            if job.is_boot:
+                n_boots += 1
+            self._queued.remove(job)
+            self._running.append(job)
+            job.command_progress.set_queue_position(None)
+            job.command_progress.set_state(keys.CommandProgressStates.ACTIVE)
+            Thread(target=self._run, args=(job,)).start()
+        for queue_position, job in enumerate(self._queued, 1):
+            job.command_progress.set_queue_position(queue_position)
+
+    def _run(self, job):
+        try:
+            job.func()
+        except Exception:
+            pass # already reported through the job's command progress
+        finally:
+            with self._lock:
+                self._running.remove(job)
+                self._dispatch()
+            job.done.set()
+
+job_scheduler = JobScheduler(settings.max_concurrent_jobs,
+    settings.max_concurrent_boots)
+
+class StatusCacheInvalidator(object):
+    """
+    CommandProgress observer which drops the project's cached status as soon
+    as its command is done. Add it before any other observers so they can't
+    see the command as done and then get the old status.
+    """
+
+    def update(self, command_progress, event):
+        if is_final_progress_event(event):
+            status_cache.invalidate(command_progress.project_name)
 
 def run_vagrant_cmd(command_list, project_directory, blocking=False,
-        msg_transformer=None, callback=None):
+        msg_transformer=None, callback=None,
+        priority=keys.JOB_PRIORITY_START, is_boot=False):
     """
     command_list -- must be a list ready for subprocess to use.
+
+    The command is run by job_scheduler (see Job for priority and is_boot).
+    If blocking, waits until it has finished.
+
+    The CommandProgress returned is registered in command_registry.
     """
-    command_progress = CommandProgress()
-    cmd = partial(execute_blocking_vagrant_cmd, command_list,
-        project_directory, command_progress, msg_transformer, callback)
-    try:
-        if blocking:
-            cmd()
-        else:
-            t = Thread(target=cmd)
-            t.start()
-    finally:
-        return command_progress
+    project_name = os.path.basename(os.path.normpath(project_directory))
+    log_dir = join(project_directory, keys.BASIL_LOG_DIR)
+    prune_command_logs(log_dir, settings.command_log_retention_count - 1)
+    command_progress = CommandProgress(" ".join(command_list), project_name,
+        log_dir)
+    command_progress.addObserver(StatusCacheInvalidator())
+    command_registry.register(command_progress)
+    def cmd():
+        try:
+            execute_blocking_vagrant_cmd(command_list, project_directory,
+                command_progress, msg_transformer, callback)
+        finally:
+            # whatever happened, the project state may well have changed
+            status_cache.invalidate(project_name)
+    job = job_scheduler.submit(Job(cmd, command_progress, priority, is_boot))
+    if blocking:
+        job.wait()
+    return command_progress
+
+def cancel_command(command_id):
+    return job_scheduler.cancel(command_id)
 
 def start_msg_transformer(text):
     bringing_up = "Bringing machine up"
@@ -715,7 +2238,8 @@ def start_project(project_directory):
     """
     command_progress = run_vagrant_cmd(command_list=["vagrant", "up"],
         project_directory=project_directory, blocking=False,
-        msg_transformer=start_msg_transformer)
+        msg_transformer=start_msg_transformer,
+        priority=keys.JOB_PRIORITY_START, is_boot=True)
     return command_progress
 
 def open_code(project_directory):
@@ -828,46 +2352,95 @@ def open_shell(project_directory):
     else:
         raise Exception("Unexpected platform when trying to open ssh")
 
-def stop_project(project_directory):
+def stop_project(project_directory, wait=False):
     """
     Stop project - vagrant halt.
+
+    wait -- if True, only return once the command has finished. Otherwise
+    follow it through the returned command progress.
     """
     command_progress = run_vagrant_cmd(command_list=["vagrant", "halt"],
-        project_directory=project_directory, blocking=True)
+        project_directory=project_directory, blocking=wait,
+        priority=keys.JOB_PRIORITY_STOP)
     return command_progress
 
-def reset_project(project_directory):
+def reset_project(project_directory, wait=False):
     """
     Reprovision project - vagrant provision.
+
+    wait -- as for stop_project.
     """
     command_progress = run_vagrant_cmd(command_list=["vagrant", "provision"],
-        project_directory=project_directory, blocking=True)
+        project_directory=project_directory, blocking=wait,
+        priority=keys.JOB_PRIORITY_RESET, is_boot=True)
     return command_progress
 
-def destroy_project(project_directory):
+def destroy_project(project_directory, wait=False):
     """
     Destroy project - vagrant destroy. Note - it is assumed that you have
     already checked with the user that this is what they really want to do.
     Too late if you get to here ;-).
+
+    wait -- as for stop_project. The project directory is gone by the time the
+    command is reported as finished.
     """
-    callback = partial(shutil.rmtree, project_directory)
+    callback = partial(remove_project_directory, project_directory)
     command_progress = run_vagrant_cmd(command_list=["vagrant", "destroy", "--force"],
-        project_directory=project_directory, blocking=True, callback=callback)
+        project_directory=project_directory, blocking=wait, callback=callback,
+        priority=keys.JOB_PRIORITY_STOP)
     return command_progress
 
-def check_project_ports(project_name):
-  """
-  Returns a list of project ports that are unreachable.
-  """
-  project = get_project_info(project_name)
-  failed = []
-  for name, port in project.ports.items():
-      try:
-          connection = http.client.HTTPConnection('localhost', port)
-          connection.request("HEAD", "/")
-          connection.getresponse()
-      except:
-          failed.append(name)
-      finally:
-          connection.close()
-  return failed
+def remove_project_directory(project_directory):
+    """
+    Remove a destroyed project's folder and free up its ports.
+    """
+    shutil.rmtree(project_directory)
+    project_name = os.path.basename(os.path.normpath(project_directory))
+    project_catalogue.discard(project_name)
+    port_allocator.release(project_name)
+
+def get_project_ports(project_names):
+    """
+    Returns a list of (project_name, port tag, port) for every port of every
+    project. Projects whose details can't be read are left out.
+    """
+    project_ports = []
+    for project_name in project_names:
+        try:
+            project = get_project_info(project_name)
+        except Exception:
+            continue
+        project_ports.extend((project_name, name, port)
+            for name, port in project.ports.items())
+    return project_ports
+
+def check_projects_ports(project_names, mode=None, timeout=None):
+    """
+    See async_core.check_projects_ports.
+    """
+    import async_core
+    return async_core.run(async_core.check_projects_ports(project_names, mode,
+        timeout))
+
+def check_project_ports(project_name, mode=None, timeout=None):
+    """
+    Returns a list of project ports that are unreachable.
+    """
+    get_project_info(project_name) # fail if no such project
+    return check_projects_ports([project_name], mode, timeout).get(
+        project_name, [])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Basil template tools")
+    parser.add_argument("command", choices=["build-manifests"])
+    parser.add_argument("template_names", nargs="*", metavar="template_name",
+        help="defaults to every installed template")
+    args = parser.parse_args()
+    template_names = args.template_names or sorted(x for x
+        in os.listdir(templates_dir) if os.path.isdir(join(templates_dir, x)))
+    for template_name in template_names:
+        manifest = build_manifest(template_name)
+        save_manifest(template_name, manifest)
+        print("{}: {} files, {} to render".format(template_name,
+            len(manifest["files"]), sum(1 for entry in manifest["files"]
+            if entry["tags"])))
@@ -21,6 +21,7 @@ TEMPLATE = "template"
 # POST vars
 PROJECT_NAME = "project_name"
 PROJECT_DIRECTORY = "project_directory"
+WAIT = "wait"
 
 PROJECT_TEMPLATE_NAME = "template_name"
 PROJECT_TEMPLATE_VERSION = "template_version"
@@ -31,7 +32,11 @@ PROJECT_ALLOW_DESTROY = "allow_destroy"
 PROJECT_BASE = "project_base"
 
 BASIL_INTERNAL_CONFIG = ".basil"
+BASIL_LOG_DIR = ".basil_logs" # inside each project
+BASIL_PORT_INDEX = ".basil_ports.json" # inside projects_dir
+BASIL_STAGING_DIR = ".basil_staging" # inside projects_dir
 TEMPLATE_CONFIG = "config.json"
+TEMPLATE_MANIFEST = "manifest.json" # built by basil - see core.build_manifest
 
 TEMPLATE_CONFIG_FIELDS = "fields"
 TEMPLATE_CONFIG_TITLE = "title"
@@ -58,11 +63,45 @@ VAGRANT_COMMA = "%!(VAGRANT_COMMA)"
 
 VAGRANT_STATUS_STATE_UNKNOWN = "unknown"
 
+# .vagrant/machines/<machine>/<provider>/id
+VAGRANT_DOT_DIR = ".vagrant"
+VAGRANT_MACHINES_DIR = "machines"
+VAGRANT_MACHINE_ID = "id"
+
+STATUS_BACKEND_AUTO = "auto"
+STATUS_BACKEND_VAGRANT = "vagrant"
+
+SERVER_MODE_DEVELOPMENT = "development"
+SERVER_MODE_PRODUCTION = "production"
+
+COPY_MODE_REFLINK = "reflink"
+COPY_MODE_HARDLINK = "hardlink"
+COPY_MODE_COPY = "copy"
+
 PROGRESS_STATE = "state"
 PROGRESS_PROGRESS = "progress"
 PROGRESS_SUMMARY = "summary"
 PROGRESS_DETAILS = "details"
 PROGRESS_ERROR = "error"
+PROGRESS_COMMAND_ID = "command_id"
+PROGRESS_COMMAND = "command"
+PROGRESS_PROJECT_NAME = "project_name"
+PROGRESS_STARTED = "started"
+PROGRESS_FINISHED = "finished"
+PROGRESS_QUEUE_POSITION = "queue_position"
+PROGRESS_LINES = "lines"
+PROGRESS_TIMES = "times"
+PROGRESS_DETAILS_OFFSET = "details_offset"
+PROGRESS_LINE_COUNT = "line_count"
+PROGRESS_NEXT_OFFSET = "next_offset"
+
+PORT_CHECK_HTTP = "http"
+PORT_CHECK_TCP = "tcp"
+
+# lower runs first - stopping things frees up resources for starting others
+JOB_PRIORITY_STOP = 0
+JOB_PRIORITY_RESET = 1
+JOB_PRIORITY_START = 2
 
 from enum import Enum
 
@@ -70,3 +109,5 @@ class CommandProgressStates(Enum):
     ACTIVE = 1
     FINISHED = 2
     ERROR = 3
+    QUEUED = 4
+    CANCELLED = 5
@@ -22,3 +22,105 @@ import os.path
 file_dir = os.path.dirname(os.path.realpath(__file__))
 templates_dir = os.path.join(file_dir, 'src', 'basil_templates')
 projects_dir = os.path.join(file_dir, 'src', 'basil_projects')
+
+# How web.py serves basil (can be overridden on the command line - see
+# python3 web.py --help). "development" handles each request in a new thread
+# with bottle's debug mode and reloader on. "production" has server_workers
+# threads handle requests, with up to server_max_queued more waiting - any
+# beyond that get a 503.
+server_mode = "development"
+server_host = "localhost"
+server_port = 8000
+server_workers = 16
+server_max_queued = 64
+
+# Static files are served from memory, compressed where it helps (gzip, plus
+# brotli if the brotli module is installed). Page links carry a content hash
+# so browsers can keep them for static_cache_max_age seconds.
+static_cache_max_age = 365*24*60*60
+
+# Project statuses are probed concurrently (normally by running `vagrant status`
+# in each project). status_workers caps how many probes run at once and
+# status_timeout (seconds) is how long a single probe gets before the project
+# is reported with an unknown state.
+status_workers = 8
+status_timeout = 30
+
+# Project statuses are cached for status_cache_ttl seconds. Basil invalidates a
+# project's entry whenever it runs a vagrant command on it. With
+# stale_while_revalidate, expired entries are served immediately while a fresh
+# status is fetched in the background. Unknown statuses (e.g. a probe timed
+# out) are only fresh for status_cache_unknown_ttl seconds so they are retried
+# soon - but one hung project doesn't hold up every request meanwhile.
+status_cache_ttl = 60
+status_cache_unknown_ttl = 10
+status_cache_stale_while_revalidate = True
+
+# /get-statuses?wait=true holds the request for up to status_long_poll_timeout
+# seconds waiting for a project status to change before replying 304 (Not
+# Modified). No more than status_long_poll_max requests are held at once (and
+# in production mode no more than half of server_workers) so open pages can't
+# take every worker. Beyond that the 304 is immediate and asks the page to
+# come back in status_long_poll_busy_retry seconds.
+status_long_poll_timeout = 25
+status_long_poll_max = 8
+status_long_poll_busy_retry = 5
+
+# How project statuses are worked out (unless a template's lib.py overrides
+# get_project_status). "auto" reads vagrant's machine ids and asks the provider
+# (VirtualBox or libvirt) in one bulk call, only falling back to `vagrant
+# status` when that can't decide. "vagrant" always uses `vagrant status`.
+status_backend = "auto"
+vboxmanage_cmd = "VBoxManage"
+virsh_cmd = "virsh"
+libvirt_uri = "qemu:///system"
+
+# Seconds between keepalive comments on an idle command progress stream.
+progress_stream_keepalive = 15
+
+# Finished vagrant commands (and their progress details) are kept for
+# command_retention_seconds, but only the most recent command_retention_count.
+command_retention_count = 20
+command_retention_seconds = 60*60
+
+# Vagrant commands are queued and run by a scheduler. No more than
+# max_concurrent_jobs run at once and, of those, no more than
+# max_concurrent_boots can be boots or reprovisions (the heavy ones).
+max_concurrent_jobs = 4
+max_concurrent_boots = 2
+
+# Only the most recent progress_max_lines of a command's output are held in
+# memory. All of it is logged in the project's .basil_logs folder, which keeps
+# the logs of the most recent command_log_retention_count commands.
+progress_max_lines = 500
+command_log_retention_count = 20
+# the most lines returned by one request for command output
+progress_page_max_lines = 1000
+
+# How running projects' ports are checked - "http" (any reply to a HEAD request)
+# or "tcp" (a connection is enough). Each probe gives up after
+# port_check_timeout seconds and up to port_check_workers run at once.
+port_check_mode = "http"
+port_check_timeout = 2
+port_check_workers = 16
+
+# New projects get ports from port_range_start up to (but not including)
+# port_range_end - below the usual ephemeral port range. With
+# port_check_host_free, ports already taken on the host (e.g. by something
+# other than basil) are skipped.
+port_range_start = 45600
+port_range_end = 49152
+port_check_host_free = True
+
+# How template files without basil tags are put into new projects. "reflink"
+# makes copy-on-write clones where the filesystem supports them (e.g. btrfs,
+# XFS) - instant and sharing disk space until changed. "hardlink" shares the
+# template's files outright so only use it if nothing edits project files in
+# place. Both fall back to "copy" when they can't be done.
+project_copy_mode = "reflink"
+
+# Files of a new project are written by up to render_workers threads at once.
+# When creating projects in bulk, up to create_workers projects are built at
+# once.
+render_workers = 8
+create_workers = 4
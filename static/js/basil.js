@@ -295,7 +295,7 @@ function project_action(project_directory, project_name, url,
         })
         .done(function(response){
             if(success_handler){
-                success_handler();
+                success_handler(response);
             }
         })
         .fail(function(jqXHR, error, ex){
@@ -315,6 +315,21 @@ function update_details(html){
         ).scrollTop(100000000000000000);
 };
 
+function append_details(lines, times){
+    /* times -- when each line was output (seconds since epoch) */
+    var details = $("#progress-details");
+    _.each(lines, function(line, i){
+        details.append(make_el("div", [], function(div){
+            $(div).text(line);
+            if(times){
+                $(div).attr("title",
+                    new Date(times[i]*1000).toLocaleTimeString());
+            }
+        }));
+    });
+    details.scrollTop(100000000000000000);
+};
+
 function cleanup_progress(){
     $("#progress").slideUp(600, "swing",
         function(){
@@ -327,13 +342,22 @@ function cleanup_progress(){
     });
 }
 
-function show_progress(project_name, n_expected_msgs, action_lbl_doing,
-        action_lbl_doing_cap, callback){
+var command_progress_states = {
+    ACTIVE: 1,
+    FINISHED: 2,
+    ERROR: 3,
+    QUEUED: 4,
+    CANCELLED: 5,
+};
+
+function show_progress(command_id, project_name, n_expected_msgs,
+        action_lbl_doing, action_lbl_doing_cap, callback){
     $("#progress").html(
         "<p id='progress-heading'>Progress " + action_lbl_doing + " "
         + project_name + "</p>"
         + "<div id='progress-bar'></div>"
         + "<div id='progress-summary'>" + action_lbl_doing_cap + " ...</div>"
+        + "<input id='progress-cancel' type='button' value='Cancel'>"
         + "<div id='details-block'>"
             + "<img id='details-arrow' src='static/images/show_arrow.png'>"
             + "<div id='details-lbl'>Details</div>"
@@ -352,28 +376,116 @@ function show_progress(project_name, n_expected_msgs, action_lbl_doing,
             $("#details-arrow").attr("src", "static/images/show_arrow.png");
         }
         show = !show;
-    });    /* poll recursively with pauses at client end. Warning - alternative approach
-    of instant recursion at client prevented Chromium from updating the DOM till
-    function returned (even though server added pauses).*/
-    var prev_response_str = "";
-    var command_progress_states = {
-        ACTIVE: 1,
-        FINISHED: 2,
-        ERROR: 3,
-    }
-    function command_end() {
+    });
+    $("#progress-cancel").click(function(){
+        $(this).attr("disabled", "disabled");
+        $.ajax({type: "POST",
+                url: "commands/" + command_id + "/cancel",
+                dataType: "json"
+            });
+    });
+    function command_end(state) {
         // handle cleanup e.g. remove progress bar
+        $("#progress-cancel").remove();
         $("#progress-bar").progressbar({value: 100});
         setTimeout(cleanup_progress, 2000);
         if (callback){
-            callback();
+            callback(state);
         };
     }
+    function show_percent(progress) {
+        var percent = (progress*100)/n_expected_msgs;
+        $("#progress-bar").progressbar({value: percent});
+    }
+    function show_state(state, error) {
+        /* Returns true if the command has ended */
+        if (state == command_progress_states.FINISHED) {
+            $("#progress-summary").text("Finished");
+            command_end(state);
+            return true;
+        }
+        else if (state == command_progress_states.CANCELLED) {
+            $("#progress-summary").text("Cancelled");
+            command_end(state);
+            return true;
+        }
+        else if (state == command_progress_states.ERROR) {
+            var msg = "Error occurred: "
+                + error.replace(/(\r\n|\n|\r)/gm, "<br>");
+            var error_len = 120;
+            if (msg.length > error_len){
+                var error2display = msg.substring(0, error_len) + " ...";
+            } else {
+                var error2display = msg;
+            }
+            $("#progress-summary").text(error2display);
+            update_details(msg);
+            command_end(state);
+            var title = "Problem " + action_lbl_doing + " "
+                + project_name;
+            ok_dialog(title, msg);
+            return true;
+        }
+        return false;
+    }
+    var queued = false;
+    function show_queue_position(queue_position) {
+        if (queue_position){
+            queued = true;
+            $("#progress-summary").text("Waiting for other projects (number "
+                + queue_position + " in the queue) ...");
+        } else if (queued) {
+            queued = false;
+            $("#progress-summary").text(action_lbl_doing_cap + " ...");
+        }
+    }
+    function stream_progress() {
+        /* Server pushes only what has changed (Server-Sent Events) */
+        var source = new EventSource("commands/" + command_id + "/stream");
+        var first_details = true;
+        var ended = false;
+        source.addEventListener("summary", function(e){
+            $("#progress-summary").text(JSON.parse(e.data));
+        });
+        source.addEventListener("queue_position", function(e){
+            show_queue_position(JSON.parse(e.data));
+        });
+        source.addEventListener("progress", function(e){
+            show_percent(JSON.parse(e.data));
+        });
+        source.addEventListener("details", function(e){
+            if(first_details){
+                $("#progress-details").html("");
+                first_details = false;
+            }
+            var data = JSON.parse(e.data);
+            append_details(data.lines, data.times);
+        });
+        source.addEventListener("state", function(e){
+            var data = JSON.parse(e.data);
+            if(show_state(data.state, data.error)){
+                ended = true;
+                source.close();
+            }
+        });
+        source.onerror = function(){
+            // don't let the browser reconnect and replay everything - poll
+            source.close();
+            if(!ended){
+                get_progress();
+            }
+        };
+    }
+    /* poll recursively with pauses at client end. Warning - alternative approach
+    of instant recursion at client prevented Chromium from updating the DOM till
+    function returned (even though server added pauses).*/
+    var prev_response_str = "";
+    var details_offset = 0; // only ask for lines we haven't got yet
     function get_progress() {
         $.ajax({type: "GET",
                 dataType: "json",
-                async: false,
-                url: "get-command-progress"
+                url: "commands/" + command_id,
+                data: {"details_offset": details_offset}
             })
             .done(function(response){
                 //console.log(response);
@@ -381,38 +493,23 @@ function show_progress(project_name, n_expected_msgs, action_lbl_doing,
                     var response_str = response;
                 } else {
                     var response_str = JSON.stringify(response);
-                    if (response.state == command_progress_states.FINISHED) {
-                        $("#progress-summary").text("Finished");
-                        command_end();
-                    }
-                    else if (response.state == command_progress_states.ERROR) {
-                        var msg = "Error occurred: "
-                            + response.error.replace(/(\r\n|\n|\r)/gm, "<br>");
-                        var error_len = 120;
-                        if (msg.length > error_len){
-                            var error2display = msg.substring(0, error_len) + " ...";
-                        } else {
-                            var error2display = msg;
-                        }
-                        $("#progress-summary").text(error2display);
-                        update_details(msg);
-                        command_end();
-                        var title = "Problem " + action_lbl_doing + " "
-                            + project_name;
-                        ok_dialog(title, msg);
-                    }
-                    else {
+                    if(!show_state(response.state, response.error)){
                         //display progress e.g. messages (if change)
                         var changed = (prev_response_str != response_str);
                         if(changed){ // hammer the html refreshing less
                             //console.log("Changed");
                             prev_response_str = response_str;
-                            var percent = (response.progress*100)/n_expected_msgs;
-                            $("#progress-bar").progressbar({value: percent});
+                            show_percent(response.progress);
                             $("#progress-summary").text(response.summary);
+                            show_queue_position(response.queue_position);
                             if(response.details != ""){
-                                update_details(response.details.replace(/(\r\n|\n|\r)/gm, "<br>"));
+                                if(details_offset == 0){
+                                    $("#progress-details").html("");
+                                }
+                                append_details(
+                                    response.details.replace(/\n$/, "").split("\n"));
                             };
+                            details_offset = response.line_count;
                         };
                         setTimeout(get_progress, 500);
                     };
@@ -425,39 +522,64 @@ function show_progress(project_name, n_expected_msgs, action_lbl_doing,
                 ok_dialog(title, msg);
             });
     };
-    get_progress();
+    if(window.EventSource){
+        stream_progress();
+    } else {
+        get_progress();
+    }
 }
 
 function project_start(project_directory, project_name){
-    project_action(project_directory, project_name,
-        "project-start", "start", "starting");
     function update(){
         get_project_statuses();
         enable_all_btns();
         PortsChecker.start(project_name);
     };
-    show_progress(project_name, 25, "starting", "Starting", update);
+    // only follow progress once the command has been submitted
+    project_action(project_directory, project_name,
+        "project-start", "start", "starting", function(response){
+            show_progress(response.command_id, project_name, 25, "starting",
+                "Starting", update);
+        }, enable_all_btns);
 };
 
 function project_stop(project_directory, project_name){
+    function update(state){
+        get_project_statuses();
+        enable_all_btns();
+        // still running if it didn't stop
+        if (state != command_progress_states.FINISHED){
+            PortsChecker.start(project_name);
+        };
+    };
     PortsChecker.stop(project_name);
     project_action(project_directory, project_name,
         "project-stop", "stop", "stopping",
-        get_project_statuses, function() {
+        function(response){
+            show_progress(response.command_id, project_name, 5, "stopping",
+                "Stopping", update);
+        }, function() {
             enable_all_btns();
             PortsChecker.start(project_name);
         });
 };
 
 function project_reset(project_directory, project_name){
+    function update(){
+        get_project_statuses();
+        enable_all_btns();
+        PortsChecker.start(project_name);
+    };
     PortsChecker.stop(project_name);
     project_action(project_directory, project_name,
         "project-reset", "reset", "resetting",
-        get_project_statuses, function() {
+        function(response){
+            show_progress(response.command_id, project_name, 10, "resetting",
+                "Resetting", update);
+        }, function() {
             enable_all_btns();
             PortsChecker.start(project_name);
         });
-    show_progress(project_name, 10, "resetting", "Resetting");
 };
 
 function confirm_destroy(project_directory, project_name) {
@@ -484,7 +606,16 @@ function confirm_destroy(project_directory, project_name) {
 			        $( this ).dialog("close");
               PortsChecker.stop(project_name);
               project_action(project_directory, project_name, "project-destroy",
-                  "destroy", "destroying", get_project_statuses, function() {
+                  "destroy", "destroying", function(response){
+                      show_progress(response.command_id, project_name, 5,
+                          "destroying", "Destroying", function(state){
+                              get_project_statuses();
+                              enable_all_btns();
+                              if (state != command_progress_states.FINISHED){
+                                  PortsChecker.start(project_name);
+                              };
+                          });
+                  }, function() {
                       enable_all_btns();
                       PortsChecker.start(project_name);
                   })
@@ -577,6 +708,95 @@ function add_std_button(td, id, classes, value, action_func, status){
     }));
 };
 
+var status_btn_id = 0;
+
+function make_status_row(status){
+    return make_el("tr", [], function(tr){
+        $(tr).attr("data-project-name", status["project_name"]);
+        $(tr).append(make_el("td", ["projs-col"], function(td){
+            $(td).html("<span class='project-name'>"
+                + status["project_name"]
+                + "</span><br><span class='project-template'>"
+                + "(from " + status["template_name"] + " "
+                + status["template_version"] + ")</span>");
+        }));
+        $(tr).append(make_el("td", ["status-col"], function(td){
+            $(td).html("<strong>" + status["project_state"]
+                + "</strong> - " + status["project_state_msg"]);
+        }))
+        $(tr).append(make_el("td", ["actions-col"], function(td){
+            switch(status["project_state"]){
+                case "unknown":
+                    break;
+                case "Not Created":
+                case "Aborted":
+                case "Poweroff":
+                    // Start, Destroy
+                    status_btn_id++;
+                    add_std_button(td, status_btn_id, ["action_button"], "Start",
+                        project_start, status);
+                    if (status["allow_destroy"]){
+                        status_btn_id++;
+                        add_std_button(td, status_btn_id, ["float-right", "action_button"],
+                            "Destroy", project_destroy, status);
+                    }
+                    break;
+                case "Running":
+                    PortsChecker.start(status["project_name"]);
+                    // View, Code, Command, Stop, Reset, Destroy
+                    $(td).append(make_el("input", ["action_button"], function(btn){
+                        $(btn).attr({
+                            "id": "btn_" + ++status_btn_id,
+                            "name": "btn_" + status_btn_id,
+                            "type": "button",
+                            "value": "View"}
+                        );
+                        var view_url = "'http://localhost:"
+                            + status["webserver_port"] + "'";
+                        var view_cmd = "window.open(" + view_url + ")";
+                        $(btn).attr({
+                            "onClick": view_cmd,
+                            "title": "Open \"" + status["project_name"]
+                                + "\" (on " + view_url + ")"}
+                        );
+                    }));
+                    $(td).append(make_el("input", ["action_button"], function(btn){
+                        $(btn).attr({
+                            "id": "btn_" + ++status_btn_id,
+                            "name": "btn_" + status_btn_id,
+                            "type": "button",
+                            "value": "Code"}
+                        ).click(function(){
+                            open_code(status["project_directory"]);
+                        });
+                    }));
+                    $(td).append(make_el("input", ["action_button"], function(btn){
+                        $(btn).attr({
+                            "id": "btn_" + ++status_btn_id,
+                            "name": "btn_" + status_btn_id,
+                            "type": "button",
+                            "value": "Run Command"}
+                        ).click(function(){
+                            open_shell(status["project_directory"]);
+                        });
+                    }));
+                    status_btn_id++;
+                    add_std_button(td, status_btn_id, ["action_button"], "Stop", project_stop,
+                        status);
+                    if (status["allow_destroy"]){
+                        status_btn_id++;
+                        add_std_button(td, status_btn_id, ["float-right", "action_button"],
+                            "Destroy", project_destroy, status);
+                    }
+                    status_btn_id++;
+                    add_std_button(td, status_btn_id, ["float-right", "action_button"],
+                        "Reset", project_reset, status);
+                    break;
+             };
+        }));
+    });
+};
+
 function display_project_statuses(response){
     $("#loading-projects").text("");
     $("#project-statuses > table").remove();
@@ -596,159 +816,185 @@ function display_project_statuses(response){
             }));
         }));
         $(table).append(make_el("tbody", [], function(tbody){
-             var id = 0;
              _.each(response, function(status){
                 //console.log(status);
-                $(tbody).append(make_el("tr", [], function(tr){
-                    $(tr).append(make_el("td", ["projs-col"], function(td){
-                        $(td).html("<span class='project-name'>"
-                            + status["project_name"]
-                            + "</span><br><span class='project-template'>"
-                            + "(from " + status["template_name"] + " "
-                            + status["template_version"] + ")</span>");
-                    }));
-                    $(tr).append(make_el("td", ["status-col"], function(td){
-                        $(td).html("<strong>" + status["project_state"]
-                            + "</strong> - " + status["project_state_msg"]);
-                    }))
-                    $(tr).append(make_el("td", ["actions-col"], function(td){
-                        switch(status["project_state"]){
-                            case "unknown":
-                                break;
-                            case "Not Created":
-                            case "Aborted":
-                            case "Poweroff":
-                                // Start, Destroy
-                                id++;
-                                add_std_button(td, id, ["action_button"], "Start",
-                                    project_start, status);
-                                if (status["allow_destroy"]){
-                                    id++;
-                                    add_std_button(td, id, ["float-right", "action_button"],
-                                        "Destroy", project_destroy, status);
-                                }
-                                break;
-                            case "Running":
-                                PortsChecker.start(status["project_name"]);
-                                // View, Code, Command, Stop, Reset, Destroy
-                                $(td).append(make_el("input", ["action_button"], function(btn){
-                                    $(btn).attr({
-                                        "id": "btn_" + ++id,
-                                        "name": "btn_" + id,
-                                        "type": "button",
-                                        "value": "View"}
-                                    );
-                                    var view_url = "'http://localhost:"
-                                        + status["webserver_port"] + "'";
-                                    var view_cmd = "window.open(" + view_url + ")";
-                                    $(btn).attr({
-                                        "onClick": view_cmd,
-                                        "title": "Open \"" + status["project_name"]
-                                            + "\" (on " + view_url + ")"}
-                                    );
-                                }));
-                                $(td).append(make_el("input", ["action_button"], function(btn){
-                                    $(btn).attr({
-                                        "id": "btn_" + ++id,
-                                        "name": "btn_" + id,
-                                        "type": "button",
-                                        "value": "Code"}
-                                    ).click(function(){
-                                        open_code(status["project_directory"]);
-                                    });
-                                }));
-                                $(td).append(make_el("input", ["action_button"], function(btn){
-                                    $(btn).attr({
-                                        "id": "btn_" + ++id,
-                                        "name": "btn_" + id,
-                                        "type": "button",
-                                        "value": "Run Command"}
-                                    ).click(function(){
-                                        open_shell(status["project_directory"]);
-                                    });
-                                }));
-                                id++;
-                                add_std_button(td, id, ["action_button"], "Stop", project_stop,
-                                    status);
-                                if (status["allow_destroy"]){
-                                    id++;
-                                    add_std_button(td, id, ["float-right", "action_button"],
-                                        "Destroy", project_destroy, status);
-                                }
-                                id++;
-                                add_std_button(td, id, ["float-right", "action_button"],
-                                    "Reset", project_reset, status);
-                                break;
-                         };
-                    }));
-                }));
+                $(tbody).append(make_status_row(status));
             });
         }));
     }));
 };
 
+function placeholder_status(project_name){
+    /* Stands in for a project whose status hasn't arrived yet */
+    return {
+        project_name: project_name,
+        template_name: "",
+        template_version: "",
+        project_state: "unknown",
+        project_state_msg: "Getting status ...",
+        allow_destroy: false,
+    };
+};
+
+function update_project_status(status){
+    /* Replace just the one project's row */
+    $("#project-statuses tbody > tr").filter(function(){
+        return $(this).attr("data-project-name") == status["project_name"];
+    }).replaceWith(make_status_row(status));
+};
+
 function get_project_statuses(){
     /*
-    Can't accept arguments - otherwise messes up setInterval.
+    Status changes arrive through StatusFeed so this only makes sure it is
+    polling.
     */
-    $("body").css("cursor", "progress");
-    $.ajax({type: "GET",
-        url: "get-statuses",
-        dataType: "json"})
-        .done(function(response){
-            if(response != ""){
-                display_project_statuses(response);
-                $("body").css("cursor", "default");
-            } else {
-                $("#loading-projects").text("You don't have any projects yet.");
-                $("#project-statuses > table").remove();
+    StatusFeed.poll();
+};
+
+var StatusFeed = {
+
+    /*
+    Long-polls get-statuses for whatever has changed since the last status
+    generation seen. The server holds each request until something changes
+    so an idle page costs next to nothing.
+    */
+    retry_in_ms: 30000,
+    generation: null,
+    project_names: [],
+    statuses: {},
+    polling: false,
+
+    poll: function() {
+        if (this.polling) {
+            return;
+        }
+        this.polling = true;
+        if (this.generation === null) {
+            $("body").css("cursor", "progress");
+        }
+        var self = this;
+        // "0" isn't a generation of the server's so the first request gets
+        // everything straight away
+        var data = {since: "0"};
+        if (this.generation !== null) {
+            data = {since: this.generation, wait: true};
+        }
+        $.ajax({type: "GET",
+            url: "get-statuses",
+            data: data,
+            dataType: "json"})
+            .done(function(response, textStatus, jqXHR){
+                self.polling = false;
+                try {
+                    if (jqXHR.status != 304) {
+                        self.apply(response);
+                    }
+                } finally {
+                    // keep polling even if this response couldn't be shown
+                    // - the server is holding as many polls as it will if
+                    // there is a Retry-After
+                    var retry_after = jqXHR.getResponseHeader("Retry-After");
+                    if (retry_after) {
+                        setTimeout(function(){
+                            self.poll();
+                        }, retry_after*1000);
+                    } else {
+                        self.poll();
+                    }
+                }
+            })
+            .fail(function(jqXHR, textStatus, errorThrown){
+                self.polling = false;
+                self.generation = null;
                 $("body").css("cursor", "default");
-            };
-        })
-        .fail(function(jqXHR, textStatus, errorThrown){
-            ok_dialog("Problem with project data",
-                "Unable to access project status data. Original problem: "
-                + jqXHR.responseText);
-            $("#loading-projects").text("Problem accessing projects information. "
-                + jqXHR.responseText);
+                ok_dialog("Problem with project data",
+                    "Unable to access project status data. Original problem: "
+                    + jqXHR.responseText);
+                $("#loading-projects").text("Problem accessing projects information. "
+                    + jqXHR.responseText);
+                setTimeout(function(){
+                    self.poll();
+                }, self.retry_in_ms);
+            });
+    },
+
+    apply: function(response) {
+        var self = this;
+        var is_first = (this.generation === null);
+        this.generation = response.generation;
+        _.each(response.statuses, function(status){
+            self.statuses[status["project_name"]] = status;
         });
-};
+        $("body").css("cursor", "default");
+        if (response.project_names.length == 0) {
+            this.project_names = [];
+            this.statuses = {};
+            $("#loading-projects").text("You don't have any projects yet.");
+            $("#project-statuses > table").remove();
+            return;
+        }
+        if (is_first || !_.isEqual(response.project_names, this.project_names)) {
+            this.project_names = response.project_names;
+            this.statuses = _.pick(this.statuses, this.project_names);
+            display_project_statuses(_.map(this.project_names, function(name){
+                return self.statuses[name] || placeholder_status(name);
+            }));
+            return;
+        }
+        _.each(response.statuses, update_project_status);
+    },
+
+}
 
 var PortsChecker = {
 
+    /* One timer checks the ports of every running project in one request */
     interval: 5000,
-    tasks: {},
+    projects: {},
+    timer: null,
     paused: false,
 
     start: function(project_name) {
-        if (project_name in this.tasks) {
+        this.projects[project_name] = true;
+        if (this.timer !== null) {
             return;
         }
         var self = this;
-        this.tasks[project_name] = setInterval(function() {
-            if (!self.paused) {
-                $.ajax({type: "GET",
-                    url: "check-ports",
-                    data: {
-                        project_name: project_name,
-                    },
-                    dataType: "json",
-                })
-               .done(function(response){
-                    if (response.unavailable_ports.length > 0) {
-                        self.stop(project_name);
-                        alert('Ports inaccessible on ' + project_name + ': '
-                          + response.unavailable_ports.join(', '));
-                    }
-                });
-            }
+        this.timer = setInterval(function() {
+            self.check();
         }, this.interval);
     },
 
+    check: function() {
+        var project_names = _.keys(this.projects);
+        if (this.paused || project_names.length == 0) {
+            return;
+        }
+        var self = this;
+        $.ajax({type: "GET",
+            url: "check-ports-batch",
+            data: {
+                project_name: project_names,
+            },
+            traditional: true, // project_name=a&project_name=b
+            dataType: "json",
+        })
+       .done(function(response){
+            _.each(response.unavailable_ports, function(ports, project_name){
+                if (ports.length > 0 && project_name in self.projects) {
+                    self.stop(project_name);
+                    alert('Ports inaccessible on ' + project_name + ': '
+                      + ports.join(', '));
+                }
+            });
+        });
+    },
+
     stop: function(project_name) {
-        if (project_name in this.tasks) {
-            clearInterval(this.tasks[project_name]);
-            delete this.tasks[project_name];
+        delete this.projects[project_name];
+        if (_.isEmpty(this.projects) && this.timer !== null) {
+            clearInterval(this.timer);
+            this.timer = null;
         }
     },
 
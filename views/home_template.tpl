@@ -2,18 +2,18 @@
     <head>
         <meta charset="UTF-8">
         <title>{{title}}</title>
-        <link rel="icon" href="static/images/favicon.png">
-        <link rel="stylesheet" href="static/css/jquery-ui.min.css">
-        <link rel="stylesheet" href="static/css/main.css">
-        <script type="text/javascript" src="static/js/jquery.min.js"></script>
-        <script type="text/javascript" src="static/js/underscore-min.js"></script>
-        <script type="text/javascript" src="static/js/jquery-ui.min.js"></script>
-        <script type="text/javascript" src="static/js/basil.js"></script>
-        <script type="text/javascript" src="static/js/home.js"></script>
+        <link rel="icon" href="{{static_url('images/favicon.png')}}">
+        <link rel="stylesheet" href="{{static_url('css/jquery-ui.min.css')}}">
+        <link rel="stylesheet" href="{{static_url('css/main.css')}}">
+        <script type="text/javascript" src="{{static_url('js/jquery.min.js')}}"></script>
+        <script type="text/javascript" src="{{static_url('js/underscore-min.js')}}"></script>
+        <script type="text/javascript" src="{{static_url('js/jquery-ui.min.js')}}"></script>
+        <script type="text/javascript" src="{{static_url('js/basil.js')}}"></script>
+        <script type="text/javascript" src="{{static_url('js/home.js')}}"></script>
     </head>
     <body>
         <a href="/" title="Home page">
-            <image id="basil-logo" src="static/images/basil_logo.png">
+            <image id="basil-logo" src="{{static_url('images/basil_logo.png')}}">
         </a>
         <h1>Basil projects</h1>
         <h2>Make a new project</h2>
@@ -19,12 +19,27 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 BasilManagerHandler.__init__ does url handler config
 
 """
+import argparse
+from collections import namedtuple
+import gzip
+import hashlib
 import json
+import mimetypes
 import os
 from os.path import join
+import queue
+import re
+import socketserver
 import sys
+from threading import Lock, Thread
+import time
+from wsgiref.simple_server import WSGIServer
 
 import bottle
+try:
+    import brotli
+except ImportError:
+    brotli = None # gzip only
 
 import core
 import keys
@@ -55,19 +70,236 @@ status2friendly = {
         Home Page). Don't forget to Close it before turning off your machine.
         """}
 
-command_progress = None
+static_root = join(os.path.dirname(os.path.abspath(core.__file__)), "static")
+# content types worth compressing (images are compressed already)
+compressible_type_re = re.compile(r"^(text/|application/(javascript|json|xml)"
+    r"|image/svg\+xml)")
+css_url_re = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+# encoding: compress(data). Preferred first.
+asset_encoders = [("gzip", lambda data: gzip.compress(data, 9))]
+if brotli:
+    asset_encoders.insert(0, ("br", brotli.compress))
+
+# variants maps content encoding (None for identity) to the encoded bytes
+StaticAsset = namedtuple("StaticAsset", ("signature", "content_type", "digest",
+    "variants"))
+
+
+class StaticAssets(object):
+    """
+    Everything under static_root, read once and kept in memory along with
+    compressed variants (gzip, plus brotli if installed) and a content hash.
+
+    Pages link to assets through url(), which adds the hash (?v=<hash>), so
+    those requests can be cached by the browser forever - any change to the
+    file changes the url. Other requests get the hash as a strong ETag and
+    must revalidate. url() references in stylesheets are fingerprinted too.
+
+    Files are checked (mtime and size) on each request so edits show up
+    without a restart.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._assets = {}
+        self._lock = Lock()
+
+    def load(self):
+        """
+        Read every asset. Stylesheets go last so the assets they refer to
+        already have their hashes.
+        """
+        paths = []
+        for dirpath, unused, filenames in os.walk(self.root):
+            paths.extend(os.path.relpath(join(dirpath, filename),
+                self.root).replace(os.sep, "/") for filename in filenames)
+        for path in sorted(paths, key=lambda x: x.endswith(".css")):
+            self.get(path)
+
+    def _full_path(self, path):
+        full_path = os.path.abspath(join(self.root, path))
+        if not full_path.startswith(os.path.join(self.root, "")):
+            return None
+        return full_path
+
+    def get(self, path):
+        """
+        The StaticAsset for path (relative to root, with forward slashes) or
+        None if there is no such file.
+        """
+        full_path = self._full_path(path)
+        if full_path is None:
+            return None
+        try:
+            file_stat = os.stat(full_path)
+        except OSError:
+            return None
+        signature = (file_stat.st_mtime_ns, file_stat.st_size)
+        with self._lock:
+            asset = self._assets.get(path)
+        if asset and asset.signature == signature:
+            return asset
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        asset = self._make_asset(path, signature, data)
+        with self._lock:
+            self._assets[path] = asset
+        return asset
+
+    def _make_asset(self, path, signature, data):
+        content_type, unused = mimetypes.guess_type(path)
+        content_type = content_type or "application/octet-stream"
+        if content_type == "text/css":
+            data = self._fingerprint_css(path, data)
+        if content_type.startswith("text/"):
+            content_type += "; charset=UTF-8"
+        variants = {None: data}
+        if compressible_type_re.match(content_type):
+            for encoding, compress in asset_encoders:
+                encoded = compress(data)
+                if len(encoded) < len(data):
+                    variants[encoding] = encoded
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        return StaticAsset(signature, content_type, digest, variants)
+
+    def _fingerprint_css(self, path, data):
+        css_dir = os.path.dirname(path)
+        def fingerprint(match):
+            quote, ref = match.groups()
+            if ref.startswith(("data:", "/", "#")) or ":" in ref:
+                return match.group(0)
+            asset_path = os.path.normpath(join(css_dir, ref)).replace(os.sep,
+                "/")
+            return "url({0}{1}{0})".format(quote, self._versioned(asset_path,
+                ref))
+        return css_url_re.sub(fingerprint, str(data, "utf-8")).encode("utf-8")
+
+    def _versioned(self, path, url):
+        asset = self.get(path)
+        return "{}?v={}".format(url, asset.digest) if asset else url
+
+    def url(self, path):
+        """
+        Fingerprinted url for an asset e.g. for the page template.
+        """
+        return self._versioned(path, "static/{}".format(path))
+
+static_assets = StaticAssets(static_root)
+
+def accepted_encodings():
+    """
+    Content encodings the client accepts (per Accept-Encoding).
+    """
+    encodings = set()
+    for item in bottle.request.headers.get("Accept-Encoding", "").split(","):
+        params = item.strip().split(";")
+        encoding = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            name, unused, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if encoding and quality > 0:
+            encodings.add(encoding)
+    return encodings
+
+
+class CachedPage(object):
+    """
+    A page rendered from a bottle SimpleTemplate, kept until the template
+    catalogue changes (core.template_registry.version), the page template
+    file changes, or a static asset it links to gets a new url.
+
+    The compiled SimpleTemplate is kept too - including in debug mode, where
+    bottle.template would recompile it on every call.
+    """
+
+    def __init__(self, template_name, **template_args):
+        self.template_name = template_name
+        self.template_args = template_args
+        self._template = None # (file signature, SimpleTemplate)
+        self._page = None # (key, static urls used, rendered bytes)
+
+    def _get_template(self):
+        template_path = bottle.SimpleTemplate.search(self.template_name,
+            bottle.TEMPLATE_PATH)
+        if not template_path:
+            raise Exception("Unable to find the \"{}\" page template"
+                .format(self.template_name))
+        template_stat = os.stat(template_path)
+        signature = (template_stat.st_mtime_ns, template_stat.st_size)
+        cached = self._template
+        if cached and cached[0] == signature:
+            return cached
+        cached = (signature, bottle.SimpleTemplate(name=self.template_name,
+            lookup=bottle.TEMPLATE_PATH))
+        self._template = cached
+        return cached
+
+    def render(self):
+        template_infos = core.get_templates() # picks up template changes
+        signature, template = self._get_template()
+        key = (core.template_registry.version, signature)
+        cached = self._page
+        if (cached and cached[0] == key and all(static_assets.url(path) == url
+                for path, url in cached[1].items())):
+            return cached[2]
+        static_urls = {}
+        def static_url(path):
+            static_urls[path] = static_assets.url(path)
+            return static_urls[path]
+        page = template.render(template_infos=template_infos,
+            static_url=static_url, **self.template_args).encode("utf-8")
+        self._page = (key, static_urls, page)
+        return page
+
+home_page = CachedPage('home_template', title="Basil Project Manager",
+    template_dropdown=keys.TEMPLATE)
 
 @bottle.route('/')
 def home():
-    return bottle.template('home_template', title="Basil Project Manager",
-        template_dropdown=keys.TEMPLATE,
-        template_infos=core.get_templates())
+    return home_page.render()
 
 @bottle.route('/static/<filepath:path>')
 def server_static(filepath):
-    static_path = os.path.split(core.__file__)[0]
-    return bottle.static_file(filepath,
-        root='{}/static'.format(static_path))
+    """
+    Serve a precompressed variant if the client accepts one. Fingerprinted
+    urls (see StaticAssets.url) are cached for
+    settings.static_cache_max_age; anything else is revalidated by ETag.
+    """
+    asset = static_assets.get(filepath)
+    if asset is None:
+        return bottle.HTTPError(404, "File does not exist.")
+    encoding = None
+    if len(asset.variants) > 1:
+        accepted = accepted_encodings()
+        for candidate, unused in asset_encoders:
+            if candidate in asset.variants and candidate in accepted:
+                encoding = candidate
+                break
+    etag = '"{}{}"'.format(asset.digest,
+        "-{}".format(encoding) if encoding else "")
+    headers = {"ETag": etag}
+    if len(asset.variants) > 1:
+        headers["Vary"] = "Accept-Encoding"
+    if bottle.request.query.get("v") == asset.digest:
+        headers["Cache-Control"] = "public, max-age={}, immutable".format(
+            settings.static_cache_max_age)
+    else:
+        headers["Cache-Control"] = "no-cache"
+    if_none_match = bottle.request.headers.get("If-None-Match", "")
+    if etag in [x.strip().replace("W/", "", 1)
+            for x in if_none_match.split(",")]:
+        return bottle.HTTPResponse(status=304, **headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = asset.variants[encoding]
+    headers["Content-Type"] = asset.content_type
+    headers["Content-Length"] = str(len(body))
+    return bottle.HTTPResponse(body, **headers)
 
 @bottle.get('/get-fields')
 def get_template_fields():
@@ -75,45 +307,172 @@ def get_template_fields():
     fields = core.get_fields(template_name)
     return json.dumps(fields)
 
+@bottle.post('/reload-templates')
+def reload_templates():
+    """
+    Pick up changes to templates straight away.
+    """
+    return {"template_version": core.reload_templates()}
+
 @bottle.post('/create-project')
 def create_project():
     template_name = bottle.request.forms.get(keys.PROJECT_TEMPLATE_NAME)
     values = {item: bottle.request.forms[item] for item in bottle.request.forms}
     del values[keys.PROJECT_TEMPLATE_NAME] # don't handle template name twice
     try:
-        core.create(template_name, values)
+        timings = core.create(template_name, values)
     except Exception as e:
         errors = json.dumps(e.args[0])
         return bottle.HTTPError(status=500, exception=errors)
+    # shows up in the browser's developer tools (milliseconds)
+    bottle.response.set_header("Server-Timing", ", ".join(
+        "{};dur={:.1f}".format(phase, seconds*1000)
+        for phase, seconds in timings.items()))
     return json.dumps("Successfully created project \"{}\""
         .format(values[keys.PROJECT_NAME]))
 
+@bottle.post('/create-projects')
+def create_projects():
+    """
+    Create several projects from one template. Post JSON e.g.
+    {"template_name": "lamp_basic", "projects": [{"project_name": "ws1"},
+    {"project_name": "ws2"}]}. Replies with a result for each project - see
+    core.create_many.
+    """
+    request_data = bottle.request.json or {}
+    template_name = request_data.get(keys.PROJECT_TEMPLATE_NAME)
+    values_list = request_data.get("projects")
+    if not template_name or not isinstance(values_list, list) or not all(
+            isinstance(values, dict) for values in values_list):
+        return bottle.HTTPError(status=400, exception=json.dumps("Post JSON "
+            "with a template_name and a list of projects"))
+    try:
+        results = core.create_many(template_name, values_list)
+    except Exception as e:
+        return bottle.HTTPError(status=500, exception=json.dumps(str(e)))
+    return json.dumps({"results": results})
+
 @bottle.error(500)
 def error500(error): # don't want the default error 500 page
     return error.exception
 
+def status_feedback(project_status):
+    project_state_display = (project_status.state.title()
+        .replace("_", " "))
+    return {
+        "project_name": project_status.project_name,
+        "project_directory": join(settings.projects_dir,
+            project_status.project_name),
+        "template_name": project_status.template_name,
+        "template_version": project_status.template_version,
+        "project_state": project_state_display,
+        "project_state_msg": status2friendly.get(
+            project_status.state, project_status.state_human_long)
+            .format(project_status.project_name),
+        "webserver_port": project_status.webserver_port,
+        "allow_destroy": project_status.allow_destroy,
+    }
+
+class HeldRequests(object):
+    """
+    Counts requests being held open (long-polls) so no more than limit are
+    held at once - each one ties up a server worker.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._held = 0
+        self._lock = Lock()
+
+    def acquire(self):
+        """
+        Returns False if limit requests are already held.
+        """
+        with self._lock:
+            if self._held >= self.limit:
+                return False
+            self._held += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._held -= 1
+
+long_polls = HeldRequests(settings.status_long_poll_max)
+
+def get_known_generation():
+    """
+    The status generation the client already has - from since or an
+    If-None-Match header (ETag). None if neither.
+    """
+    since = bottle.request.query.get("since")
+    if since:
+        return since
+    etag = bottle.request.headers.get("If-None-Match", "")
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"') or None
+
 @bottle.route('/get-statuses')
 def get_statuses():
+    """
+    Every project's status (the ETag is the status generation), or with
+    since=<generation> only the statuses which have changed since then plus
+    the names of all projects (in order) so the client can see which have
+    gone.
+
+    Replies 304 if nothing has changed since the generation the client has
+    (since or If-None-Match). With since and wait=true, holds the request
+    until something changes or settings.status_long_poll_timeout runs out.
+    If-None-Match alone never waits - a browser adds it to requests of its
+    own accord (e.g. on reload) and would be kept waiting for nothing. If
+    long_polls are at their limit the 304 is immediate with a Retry-After.
+    """
+    known_generation = get_known_generation()
+    is_long_poll = bool(bottle.request.query.get("since")) and get_flag("wait")
+    is_held = is_long_poll and long_polls.acquire()
+    wait_until = time.monotonic() + (settings.status_long_poll_timeout
+        if is_held else 0)
     try:
-        project_statuses = core.get_project_statuses()
-        project_feedback = []
-        if project_statuses:
-            for project_status in project_statuses:
-                project_state_display = (project_status.state.title()
-                    .replace("_", " "))
-                project_feedback.append({
-                    "project_name": project_status.project_name,
-                    "project_directory": join(settings.projects_dir,
-                        project_status.project_name),
-                    "template_name": project_status.template_name,
-                    "template_version": project_status.template_version,
-                    "project_state": project_state_display,
-                    "project_state_msg": status2friendly.get(
-                        project_status.state, project_status.state_human_long)
-                        .format(project_status.project_name),
-                    "webserver_port": project_status.webserver_port,
-                    "allow_destroy": project_status.allow_destroy,
-                })
+        while True:
+            updates = core.status_cache.updates
+            # cheap when cached, and sets off refreshes of stale statuses
+            project_statuses = core.get_project_statuses()
+            # None if some weren't stored (e.g. probed just before an
+            # invalidation) - the client can't be said to be up to date then
+            generation = core.status_cache.generation_of(project_statuses)
+            if generation != known_generation:
+                break
+            remaining = wait_until - time.monotonic()
+            if remaining <= 0:
+                headers = {"ETag": '"{}"'.format(known_generation)}
+                if is_long_poll and not is_held:
+                    headers["Retry-After"] = str(
+                        settings.status_long_poll_busy_retry)
+                return bottle.HTTPResponse(status=304, headers=headers)
+            # wake up at least once per cache ttl to pick up outside changes
+            core.status_cache.wait_for_update(updates,
+                min(remaining, settings.status_cache_ttl))
+        if generation is None:
+            generation = core.status_cache.generation
+            changed = None # send everything
+        else:
+            changed = core.status_cache.changed_since(known_generation,
+                [project_status.project_name
+                for project_status in project_statuses])
+        if bottle.request.query.get("since"):
+            project_feedback = {
+                "generation": generation,
+                "project_names": [project_status.project_name
+                    for project_status in project_statuses],
+                "statuses": [status_feedback(project_status)
+                    for project_status in project_statuses
+                    if changed is None
+                    or project_status.project_name in changed],
+            }
+        elif project_statuses:
+            project_feedback = [status_feedback(project_status)
+                for project_status in project_statuses]
         else:
             project_feedback = ""
     except Exception as e:
@@ -123,11 +482,29 @@ def get_statuses():
         # can grab msg at AJAX jQuery end as jqXHR.responseText
         return bottle.HTTPError(status=500, exception=msg)
     else:
+        bottle.response.set_header("ETag", '"{}"'.format(generation))
         payload = json.dumps(project_feedback).encode("utf-8")
         return payload
+    finally:
+        if is_held:
+            long_polls.release()
+
+@bottle.route('/get-status-cache-stats')
+def get_status_cache_stats():
+    return json.dumps(core.status_cache.stats())
+
+def get_flag(name):
+    """
+    True if the named form or query string value is switched on e.g. wait=true
+    """
+    return bottle.request.params.get(name, "").lower() in ("1", "true", "yes")
 
 def get_reply_payload(func, args):
-    global command_progress
+    """
+    If func returns a CommandProgress its command id is included in the reply
+    so the client can follow that particular command. If the command has
+    already ended (e.g. wait was requested) so is its final state.
+    """
     try:
         command_progress = func(*args) # command_progress is a mutable that is probably yet to be updated (if actual task passed to a thread)
         reply_payload = {"Action state": "submitted successfully"}
@@ -135,7 +512,12 @@ def get_reply_payload(func, args):
         reply_payload = {"Unable to execute action. Error: ": str(e)}
         # ...  AND any progress requests
         command_progress = core.CommandProgress()
-        command_progress.state = keys.CommandProgressStates.ERROR
+        command_progress.set_state(keys.CommandProgressStates.ERROR, str(e))
+        core.command_registry.register(command_progress)
+    if command_progress is not None:
+        reply_payload[keys.PROGRESS_COMMAND_ID] = command_progress.command_id
+        if command_progress.is_done:
+            reply_payload.update(command_progress.state_data())
     return json.dumps(reply_payload).encode("utf-8")
 
 @bottle.post('/project-start')
@@ -143,20 +525,25 @@ def project_start():
     return get_reply_payload(func=core.start_project,
         args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY)])
 
+# stop, reset and destroy return straight away unless wait=true is posted
+
 @bottle.post('/project-stop')
 def project_stop():
     return get_reply_payload(func=core.stop_project,
-        args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY)])
+        args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY),
+            get_flag(keys.WAIT)])
 
 @bottle.post('/project-reset')
 def project_stop():
     return get_reply_payload(func=core.reset_project,
-        args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY)])
+        args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY),
+            get_flag(keys.WAIT)])
 
 @bottle.post('/project-destroy')
 def project_stop():
     return get_reply_payload(func=core.destroy_project,
-        args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY)])
+        args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY),
+            get_flag(keys.WAIT)])
 
 @bottle.post('/open-code')
 def project_stop():
@@ -168,32 +555,223 @@ def project_stop():
     return get_reply_payload(func=core.open_shell,
         args=[bottle.request.forms.get(keys.PROJECT_DIRECTORY)])
 
+def get_requested_progress(command_id=None):
+    """
+    The command asked for in the url or query string (command_id) - otherwise
+    the most recently started command. None if there isn't one.
+    """
+    if command_id is None:
+        command_id = bottle.request.query.get(keys.PROGRESS_COMMAND_ID)
+    if command_id:
+        return core.command_registry.get(command_id)
+    return core.command_registry.latest()
+
+def get_int_param(name, default=None):
+    try:
+        return int(bottle.request.query.get(name))
+    except (TypeError, ValueError):
+        return default
+
 @bottle.route('/get-command-progress')
-def get_command_progress():
+@bottle.route('/commands/<command_id>')
+def get_command_progress(command_id=None):
+    """
+    Pass details_offset to only get details from that line on (e.g. the
+    line_count from the previous reply).
+    """
+    command_progress = get_requested_progress(command_id)
+    if command_progress is None:
+        return bottle.HTTPError(status=404, exception="Unknown command")
     try:
-        payload = command_progress.to_json()
+        payload = command_progress.to_json(
+            get_int_param(keys.PROGRESS_DETAILS_OFFSET))
     except Exception as e:
         payload = ("Unable to read progress details from object. "
             "Orig error: {}".format(e))
     return payload
 
+@bottle.route('/commands/<command_id>/output')
+def get_command_output(command_id):
+    """
+    Page through a command's output - including lines no longer held in
+    memory. Pass offset (default 0) and limit. Use next_offset from the reply
+    as the offset for the next page.
+    """
+    command_progress = core.command_registry.get(command_id)
+    if command_progress is None:
+        return bottle.HTTPError(status=404, exception="Unknown command")
+    limit = min(get_int_param("limit", settings.progress_page_max_lines),
+        settings.progress_page_max_lines)
+    offset, lines = command_progress.read_details(get_int_param("offset", 0),
+        limit)
+    reply = core.details_event_data(offset, lines)
+    reply[keys.PROGRESS_NEXT_OFFSET] = offset + len(lines)
+    reply[keys.PROGRESS_LINE_COUNT] = command_progress.output.line_count
+    return json.dumps(reply)
+
+@bottle.route('/commands')
+def list_commands():
+    """
+    Active and recently finished commands (without their details). Add
+    active=1 to the query string for active commands only.
+    """
+    active_only = get_flag("active")
+    return json.dumps({"commands": [command_progress.summary_dict()
+        for command_progress
+        in core.command_registry.list(active_only=active_only)]})
+
+@bottle.post('/commands/<command_id>/cancel')
+def cancel_command(command_id):
+    return json.dumps({"cancelled": core.cancel_command(command_id)})
+
+def format_progress_event(event):
+    """
+    Server-Sent Events format. The event kind becomes the SSE event name.
+    """
+    return "event: {}\ndata: {}\n\n".format(event.kind, json.dumps(event.data))
+
+def stream_progress_events(command_progress):
+    """
+    Everything so far then each change as it happens - until the command
+    finishes or errors. Comments are sent while idle to keep the connection
+    open.
+    """
+    events = core.ProgressEventQueue()
+    snapshot = command_progress.subscribe(events)
+    try:
+        for event in snapshot:
+            yield format_progress_event(event)
+            if core.is_final_progress_event(event):
+                return
+        while True:
+            try:
+                event = events.get(timeout=settings.progress_stream_keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield format_progress_event(event)
+            if core.is_final_progress_event(event):
+                return
+    finally:
+        command_progress.removeObserver(events)
+
+@bottle.route('/command-progress/stream')
+@bottle.route('/commands/<command_id>/stream')
+def stream_command_progress(command_id=None):
+    command_progress = get_requested_progress(command_id)
+    if command_progress is None:
+        return bottle.HTTPError(status=404, exception="Unknown command")
+    bottle.response.content_type = "text/event-stream"
+    bottle.response.set_header("Cache-Control", "no-cache")
+    return stream_progress_events(command_progress)
+
 @bottle.route('/check-ports', method="GET")
 def check_ports():
   project_name = bottle.request.query.get(keys.PROJECT_NAME)
-  unavailable_ports = core.check_project_ports(project_name)
+  unavailable_ports = core.check_project_ports(project_name,
+      bottle.request.query.get("mode") or None)
+  return {'unavailable_ports': unavailable_ports}
+
+@bottle.route('/check-ports-batch', method="GET")
+def check_ports_batch():
+  """
+  Check the ports of every project_name passed (repeat the param) in one go.
+  Projects which no longer exist are left out of unavailable_ports.
+  """
+  project_names = bottle.request.query.getall(keys.PROJECT_NAME)
+  unavailable_ports = core.check_projects_ports(project_names,
+      bottle.request.query.get("mode") or None)
   return {'unavailable_ports': unavailable_ports}
 
-def run_server():
-    debug = True
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """
+    Handles each request in its own thread so a streaming response (e.g.
+    command progress) doesn't hold up every other request.
+    """
+    daemon_threads = True
+
+class PooledWSGIServer(WSGIServer):
+    """
+    Handles requests in a fixed pool of worker threads. Up to max_queued
+    connections wait for a free worker - any more are turned away straight
+    away with a 503 rather than piling up. Note - each open progress stream
+    ties up a worker for as long as it lasts.
+
+    Use configured to get a server class with other limits.
+    """
+    workers = 16
+    max_queued = 64
+
+    @classmethod
+    def configured(cls, workers, max_queued):
+        return type(cls.__name__, (cls,), {"workers": workers,
+            "max_queued": max_queued, "request_queue_size": max_queued})
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._requests = queue.Queue(self.max_queued)
+        for unused in range(self.workers):
+            Thread(target=self._work, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n"
+                    b"Retry-After: 1\r\nContent-Length: 0\r\n"
+                    b"Connection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+def run_server(mode=None, host=None, port=None, workers=None,
+        max_queued=None):
+    """
+    Run basil's web server. Arguments default to the server_* settings.
+
+    mode -- keys.SERVER_MODE_DEVELOPMENT (a thread per request plus bottle's
+    debug mode and reloader) or keys.SERVER_MODE_PRODUCTION (a pool of workers
+    threads with at most max_queued requests waiting - see PooledWSGIServer -
+    and no debug or reloader).
+    port -- the first port to try. If it is in use the next is tried and so on.
+    """
+    mode = mode or settings.server_mode
+    if mode not in (keys.SERVER_MODE_DEVELOPMENT, keys.SERVER_MODE_PRODUCTION):
+        print("Unknown server mode \"{}\"".format(mode))
+        return
+    host = host or settings.server_host
+    port = port or settings.server_port
+    debug = (mode == keys.SERVER_MODE_DEVELOPMENT)
+    if debug:
+        server_class = ThreadingWSGIServer
+    else:
+        workers = workers or settings.server_workers
+        server_class = PooledWSGIServer.configured(workers,
+            max_queued or settings.server_max_queued)
+        # leave workers for everything else
+        long_polls.limit = min(long_polls.limit, workers // 2)
     try:
         core.verify_vagrant_version()
     except Exception as ex:
         print(ex)
         return
-    port = 8000
+    core.sweep_staging()
+    static_assets.load()
     while True:
         try:
-            bottle.run(host='localhost', port=port, debug=debug, reloader=debug)
+            bottle.run(host=host, port=port, debug=debug, reloader=debug,
+                quiet=not debug, server_class=server_class)
             break
         except Exception:
             port += 1
@@ -204,4 +782,20 @@ def run_server():
         print("Note - please close again - reloader is currently set to True")
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="Run the Basil web server")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--production", dest="mode", action="store_const",
+        const=keys.SERVER_MODE_PRODUCTION,
+        help="pooled worker threads, no debug or reloader")
+    mode_group.add_argument("--development", dest="mode", action="store_const",
+        const=keys.SERVER_MODE_DEVELOPMENT,
+        help="a thread per request, debug and reloader on")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int,
+        help="worker threads (production only)")
+    parser.add_argument("--max-queued", type=int,
+        help="requests waiting for a worker before others get a 503 "
+        "(production only)")
+    args = parser.parse_args()
+    run_server(args.mode, args.host, args.port, args.workers, args.max_queued)